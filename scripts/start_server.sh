@@ -22,7 +22,7 @@ elif [ "$1" == "prod" ]; then
     --log-level=INFO \
     --pid $RESOURCE_PATH/argus_server.pid \
     --bind unix:$RESOURCE_PATH/argus_server.sock \
-    --threads=2 \
+    --threads=8 \
     --timeout=400 \
     server:app
 fi
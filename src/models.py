@@ -6,13 +6,13 @@
 import datetime
 import hashlib
 import json
-import locale
 import os
 import uuid
 from copy import deepcopy
+from operator import attrgetter
 from re import search
 
-from sqlalchemy import MetaData, Column, Integer, String, Float, Boolean, DateTime
+from sqlalchemy import MetaData, Column, Index, Integer, String, Float, Boolean, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.orm import relationship, backref
@@ -35,6 +35,29 @@ def convert2camel(data):
     return converted
 
 
+def format_time(value):
+    """Format the date time for the client (without microseconds and time zone)"""
+    return value.replace(microsecond=0, tzinfo=None).isoformat(sep=" ") if value else ""
+
+
+class Serializer(object):
+    """
+    Serialize the fields of a record to a dictionary with camel case keys.
+    The keys are converted once when the model is defined.
+
+    Fields: name of the attribute or (name, function(record)) for calculated values.
+    """
+
+    def __init__(self, *fields):
+        self._fields = tuple(
+            (camelcase(field), attrgetter(field)) if isinstance(field, str) else (camelcase(field[0]), field[1])
+            for field in fields
+        )
+
+    def __call__(self, record):
+        return {key: getter(record) for key, getter in self._fields}
+
+
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
 
@@ -79,6 +102,13 @@ class BaseModel(Base):
 
         return result
 
+    # precompiled serializer of the model (see Serializer)
+    serializer = None
+
+    @property
+    def serialize(self):
+        return self.serializer(self)
+
 
 class SensorType(BaseModel):
     """Model for sensor type table"""
@@ -96,9 +126,7 @@ class SensorType(BaseModel):
         self.name = name
         self.description = description
 
-    @property
-    def serialize(self):
-        return convert2camel(self.serialize_attributes(("id", "name", "description")))
+    serializer = Serializer("id", "name", "description")
 
     @validates("name")
     def validates_name(self, key, name):
@@ -137,11 +165,7 @@ class Sensor(BaseModel):
     def update(self, data):
         return self.update_record(("channel", "enabled", "description", "zone_id", "type_id"), data)
 
-    @property
-    def serialize(self):
-        return convert2camel(
-            self.serialize_attributes(("id", "channel", "alert", "description", "zone_id", "type_id", "enabled"))
-        )
+    serializer = Serializer("id", "channel", "alert", "description", "zone_id", "type_id", "enabled")
 
     @validates("name")
     def validates_name(self, key, name):
@@ -154,10 +178,118 @@ class Sensor(BaseModel):
         return channel
 
 
+class SensorReference(BaseModel):
+    """Model for the audit trail of the reference values of the sensors"""
+
+    __tablename__ = "sensor_reference"
+    __table_args__ = (Index("ix_sensor_reference_sensor_id_time", "sensor_id", "time"),)
+
+    id = Column(Integer, primary_key=True)
+    sensor_id = Column(Integer, ForeignKey("sensor.id"), nullable=False)
+    time = Column(DateTime(timezone=True), nullable=False)
+    # calibration / adaptation
+    reason = Column(String, nullable=False)
+    old_value = Column(Float, nullable=True)
+    new_value = Column(Float, nullable=False)
+    # the result of the last calibration (the adaptation is limited around it)
+    calibrated_value = Column(Float, nullable=False)
+
+    def __init__(self, sensor_id, time, reason, old_value, new_value, calibrated_value):
+        self.sensor_id = sensor_id
+        self.time = time
+        self.reason = reason
+        self.old_value = old_value
+        self.new_value = new_value
+        self.calibrated_value = calibrated_value
+
+    serializer = Serializer(
+        "id",
+        "sensor_id",
+        ("time", lambda reference: format_time(reference.time)),
+        "reason",
+        "old_value",
+        "new_value",
+        "calibrated_value",
+    )
+
+
+class SensorFilter(BaseModel):
+    """Model for the filter settings of the sensor readings (by sensor type and/or zone)"""
+
+    __tablename__ = "sensor_filter"
+
+    id = Column(Integer, primary_key=True)
+    # None: tolerance of the system
+    enter_tolerance = Column(Float, nullable=True)
+    # None: same as the enter tolerance
+    exit_tolerance = Column(Float, nullable=True)
+    # debounce: alert changes if <threshold> of the last <samples> readings confirm it
+    samples = Column(Integer, default=1, nullable=False)
+    threshold = Column(Integer, default=1, nullable=False)
+    # moving average of the readings
+    average_window = Column(Integer, default=1, nullable=False)
+
+    # None: applies to all the sensor types / zones
+    type_id = Column(Integer, ForeignKey("sensor_type.id"), nullable=True)
+    zone_id = Column(Integer, ForeignKey("zone.id"), nullable=True)
+
+    def __init__(self, sensor_type=None, zone=None):
+        self.type_id = sensor_type.id if sensor_type else None
+        self.zone_id = zone.id if zone else None
+        self.samples = 1
+        self.threshold = 1
+        self.average_window = 1
+
+    def update(self, data):
+        record_changed = self.update_record(
+            (
+                "enter_tolerance",
+                "exit_tolerance",
+                "samples",
+                "threshold",
+                "average_window",
+                "type_id",
+                "zone_id",
+            ),
+            data,
+        )
+        assert self.threshold <= self.samples, "Threshold is not greater than the samples"
+        assert (
+            self.enter_tolerance is None or self.exit_tolerance is None or self.exit_tolerance <= self.enter_tolerance
+        ), "Exit tolerance is not greater than the enter tolerance"
+        return record_changed
+
+    serializer = Serializer(
+        "id",
+        "enter_tolerance",
+        "exit_tolerance",
+        "samples",
+        "threshold",
+        "average_window",
+        "type_id",
+        "zone_id",
+    )
+
+    @validates("enter_tolerance", "exit_tolerance")
+    def validates_tolerance(self, key, tolerance):
+        assert tolerance is None or (
+            isinstance(tolerance, (int, float)) and not isinstance(tolerance, bool) and tolerance >= 0
+        ), "Tolerance is positive number (>= 0)"
+        return tolerance
+
+    @validates("samples", "threshold", "average_window")
+    def validates_count(self, key, count):
+        assert isinstance(count, int) and not isinstance(count, bool), f"Incorrect {key} ({count} is not integer)"
+        assert count >= 1, f"Incorrect {key} ({count} < 1)"
+        return count
+
+
 class Alert(BaseModel):
     """Model for alert table"""
 
     __tablename__ = "alert"
+    # keyset pagination of the alert history
+    __table_args__ = (Index("ix_alert_start_time_id", "start_time", "id"),)
 
     id = Column(Integer, primary_key=True)
     alert_type = Column(String)
@@ -171,20 +303,13 @@ class Alert(BaseModel):
         self.end_time = end_time
         self.sensors = sensors
 
-    @property
-    def serialize(self):
-        locale.setlocale(locale.LC_ALL)
-        return convert2camel(
-            {
-                "id": self.id,
-                "alert_type": self.alert_type,
-                "start_time": self.start_time.replace(microsecond=0, tzinfo=None).isoformat(sep=" "),
-                "end_time": self.end_time.replace(microsecond=0, tzinfo=None).isoformat(sep=" ")
-                if self.end_time
-                else "",
-                "sensors": [alert_sensor.serialize for alert_sensor in self.sensors],
-            }
-        )
+    serializer = Serializer(
+        "id",
+        "alert_type",
+        ("start_time", lambda alert: format_time(alert.start_time)),
+        ("end_time", lambda alert: format_time(alert.end_time)),
+        ("sensors", lambda alert: [alert_sensor.serialize for alert_sensor in alert.sensors]),
+    )
 
 
 class AlertSensor(BaseModel):
@@ -202,9 +327,7 @@ class AlertSensor(BaseModel):
         self.type_id = type_id
         self.description = description
 
-    @property
-    def serialize(self):
-        return convert2camel(self.serialize_attributes(("sensor_id", "channel", "type_id", "description")))
+    serializer = Serializer("sensor_id", "channel", "type_id", "description")
 
 
 class Zone(BaseModel):
@@ -232,11 +355,7 @@ class Zone(BaseModel):
     def update(self, data):
         return self.update_record(("name", "description", "disarmed_delay", "away_delay", "stay_delay"), data)
 
-    @property
-    def serialize(self):
-        return convert2camel(
-            self.serialize_attributes(("id", "name", "description", "disarmed_delay", "away_delay", "stay_delay"))
-        )
+    serializer = Serializer("id", "name", "description", "disarmed_delay", "away_delay", "stay_delay")
 
     @validates("disarmed_delay", "away_delay", "stay_delay")
     def validates_away_delay(self, key, delay):
@@ -312,21 +431,18 @@ class User(BaseModel):
         ):
             return registration_code
 
-    @property
-    def serialize(self):
-        return convert2camel(
-            {
-                "id": self.id,
-                "name": self.name,
-                "email": self.email,
-                "has_registration_code": bool(self.registration_code),
-                "registration_expiry": self.registration_expiry.strftime("%Y-%m-%dT%H:%M:%S")
-                if self.registration_expiry
-                else None,
-                "role": self.role,
-                "comment": self.comment,
-            }
-        )
+    serializer = Serializer(
+        "id",
+        "name",
+        "email",
+        ("has_registration_code", lambda user: bool(user.registration_code)),
+        (
+            "registration_expiry",
+            lambda user: user.registration_expiry.strftime("%Y-%m-%dT%H:%M:%S") if user.registration_expiry else None,
+        ),
+        "role",
+        "comment",
+    )
 
     @validates("name")
     def validates_name(self, key, name):
@@ -372,12 +488,14 @@ class Option(BaseModel):
             self.value = tmp_value
             return changed
 
-    @property
-    def serialize(self):
+    def filtered_value(self):
+        """Value without the passwords"""
         filtered_value = deepcopy(json.loads(self.value))
         filter_keys(filtered_value, ["smtp_password"])
         filter_keys(filtered_value, ["password"])
-        return convert2camel({"name": self.name, "section": self.section, "value": filtered_value})
+        return filtered_value
+
+    serializer = Serializer("name", "section", ("value", filtered_value))
 
     @validates("name", "section")
     def validates_name(self, key, option):
@@ -392,6 +510,49 @@ class Option(BaseModel):
         return option
 
 
+class Notification(BaseModel):
+    """Model for the outbox of the notifications (one record for every channel of the message)"""
+
+    __tablename__ = "notification"
+    # the pending notifications of a channel by the time of the next attempt
+    __table_args__ = (Index("ix_notification_channel_state_next_attempt", "channel", "state", "next_attempt"),)
+
+    STATE_PENDING = "pending"
+    STATE_SENT = "sent"
+    STATE_FAILED = "failed"
+
+    id = Column(Integer, primary_key=True)
+    # sms / email
+    channel = Column(String, nullable=False)
+    # the message of the notifier (JSON)
+    message = Column(String, nullable=False)
+    state = Column(String, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    created = Column(DateTime(timezone=True), nullable=False)
+    next_attempt = Column(DateTime(timezone=True), nullable=False)
+    sent = Column(DateTime(timezone=True), nullable=True)
+    last_error = Column(String, nullable=True)
+
+    def __init__(self, channel, message, created):
+        self.channel = channel
+        self.message = json.dumps(message)
+        self.state = Notification.STATE_PENDING
+        self.attempts = 0
+        self.created = created
+        self.next_attempt = created
+
+    serializer = Serializer(
+        "id",
+        "channel",
+        ("message", lambda notification: json.loads(notification.message)),
+        "state",
+        "attempts",
+        ("created", lambda notification: format_time(notification.created)),
+        ("sent", lambda notification: format_time(notification.sent)),
+        "last_error",
+    )
+
+
 class Keypad(BaseModel):
     """Model for keypad table"""
 
@@ -410,9 +571,7 @@ class Keypad(BaseModel):
     def update(self, data):
         return self.update_record(("enabled", "type_id"), data)
 
-    @property
-    def serialize(self):
-        return convert2camel(self.serialize_attributes(("id", "type_id", "enabled")))
+    serializer = Serializer("id", "type_id", "enabled")
 
 
 class KeypadType(BaseModel):
@@ -429,6 +588,4 @@ class KeypadType(BaseModel):
         self.name = name
         self.description = description
 
-    @property
-    def serialize(self):
-        return convert2camel(self.serialize_attributes(("id", "name", "description")))
+    serializer = Serializer("id", "name", "description")
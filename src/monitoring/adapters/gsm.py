@@ -4,125 +4,107 @@
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:09:17
 
-import json
 import logging
-import os
 
 from gsmmodem.modem import GsmModem
-from gsmmodem.exceptions import PinRequiredError, IncorrectPinError, TimeoutException, CmeError, CmsError, CommandError
-from models import Option
+from gsmmodem.exceptions import (
+    PinRequiredError,
+    IncorrectPinError,
+    TimeoutException,
+    CmeError,
+    CmsError,
+    GsmModemException,
+)
 from monitoring.constants import LOG_ADGSM
-from monitoring.database import Session
-from time import sleep
 
 
 class GSM(object):
+    """
+    One session with the GSM modem (the connection is managed by the GSMManager).
+    """
 
-    RETRY_GAP = 5
+    # result of connecting
+    CONNECTED = "connected"
+    RETRY = "retry"
+    FAILED = "failed"
 
     def __init__(self):
         self._logger = logging.getLogger(LOG_ADGSM)
         self._modem = None
-        self._options = None
 
-    def setup(self):
-        db_session = Session()
-        section = db_session.query(Option).filter_by(name="notifications", section="gsm").first()
-        db_session.close()
+    @property
+    def connected(self):
+        return self._modem is not None
 
-        self._options = json.loads(section.value) if section else {"pin_code": ""}
-        self._options["port"] = os.environ["GSM_PORT"]
-        self._options["baud"] = os.environ["GSM_PORT_BAUD"]
-
-        if not self._options["pin_code"]:
-            self._logger.info("Pin code not defined, skip connecting to GSM modem")
-            return False
+    def connect(self, port, baud, pin_code):
+        """Try to connect to the modem once"""
+        self._logger.info("Connecting to GSM modem on %s with %s baud (PIN: %s)...", port, baud, pin_code)
+        modem = GsmModem(port, int(baud))
+        modem.smsTextMode = True
+        try:
+            modem.connect(pin_code)
+            self._logger.info("GSM modem connected")
+            self._modem = modem
+            return GSM.CONNECTED
+        except PinRequiredError:
+            self._logger.error("SIM card PIN required!")
+            result = GSM.FAILED
+        except IncorrectPinError:
+            self._logger.error("Incorrect SIM card PIN entered!")
+            result = GSM.FAILED
+        except TimeoutException as error:
+            self._logger.error("No answer from GSM module: %s! Request timeout", str(error))
+            result = GSM.RETRY
+        except CmeError as error:
+            self._logger.error("CME error from GSM module: %s! Unexpected error", str(error))
+            result = GSM.RETRY
+        except CmsError as error:
+            if str(error) == "CMS 302":
+                self._logger.debug("GSM modem not ready")
+            else:
+                self._logger.error("CMS error from GSM module: %s. Unexpected error", str(error))
+            result = GSM.RETRY
+        except Exception:
+            self._logger.exception("Failed to access GSM module!")
+            result = GSM.FAILED
 
-        self._modem = GsmModem(self._options["port"], int(self._options["baud"]))
-        self._modem.smsTextMode = True
-
-        connected = False
-        while not connected:
-            try:
-                self._logger.info(
-                    "Connecting to GSM modem on %s with %s baud (PIN: %s)...",
-                    self._options["port"],
-                    self._options["baud"],
-                    self._options["pin_code"],
-                )
-
-                self._modem.connect(self._options["pin_code"])
-                self._logger.info("GSM modem connected")
-                connected = True
-            except PinRequiredError:
-                self._logger.error("SIM card PIN required!")
-                self._modem = None
-                return False
-            except IncorrectPinError:
-                self._logger.error("Incorrect SIM card PIN entered!")
-                self._modem = None
-                return False
-            except TimeoutException as error:
-                self._logger.error(
-                    "No answer from GSM module: %s! Request timeout, retry in %s seconds...", str(error), GSM.RETRY_GAP
-                )
-            except CmeError as error:
-                self._logger.error(
-                    "CME error from GSM module: %s! Unexpected error, retry in %s seconds...", str(error), GSM.RETRY_GAP
-                )
-            except CmsError as error:
-                if str(error) == "CMS 302":
-                    self._logger.debug("GSM modem not ready, retry in %s seconds...", GSM.RETRY_GAP)
-                else:
-                    self._logger.error(
-                        "CMS error from GSM module: %s. Unexpected error, retry in %s seconds...",
-                        str(error),
-                        GSM.RETRY_GAP,
-                    )
-            except Exception:
-                self._logger.exception("Failed to access GSM module!")
-                return False
-
-            sleep(GSM.RETRY_GAP)
+        self.close_modem(modem)
+        return result
 
-        return True
-
-    def destroy(self):
+    def close(self):
         if self._modem is not None:
-            self._modem.close()
+            self.close_modem(self._modem)
+            self._modem = None
 
-    def sendSMS(self, phone_number, message):
-        if not self._modem:
-            self.setup()
+    def close_modem(self, modem):
+        try:
+            modem.close()
+        except Exception:
+            self._logger.debug("Failed to close GSM modem", exc_info=True)
 
+    def get_signal_strength(self):
+        """Return the signal strength (0..31, -1 if no network, None if the modem failed)"""
         if not self._modem:
-            return False
+            return None
+
+        try:
+            return self._modem.signalStrength
+        except GsmModemException as error:
+            self._logger.error("Failed to check signal strength: %s", error)
+            return None
 
-        if message is None:
+    def sendSMS(self, phone_number, message):
+        if not self._modem or message is None:
             return False
 
-        self._logger.debug("Checking for network coverage...")
         try:
-            self._modem.waitForNetworkCoverage(5)
-        except CommandError as error:
-            self._logger.error("Command error: %s", error)
-            return False
+            self._modem.sendSms(phone_number, message)
         except TimeoutException:
-            self._logger.error(
-                ("Network signal strength is not sufficient," " please adjust modem position/antenna and try again.")
-            )
+            self._logger.error("Failed to send message: the send operation timed out")
+            return False
+        except GsmModemException as error:
+            self._logger.error("Failed to send message: %s", error)
             return False
-        else:
-            try:
-                self._modem.sendSms(phone_number, message)
-            except TimeoutException:
-                self._logger.error("Failed to send message: the send operation timed out")
-                return False
-            except CmsError as error:
-                self._logger.error("Failed to send message: %s", error)
-                return False
-            else:
-                self._logger.debug("Message sent.")
-                return True
 
-        return False
+        self._logger.debug("Message sent.")
+        return True
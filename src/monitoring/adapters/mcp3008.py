@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+
+from gpiozero import SPIDevice
+
+
+class MCP3008Bank(SPIDevice):
+    """
+    Read the channels of one MCP3008 chip in one burst on a single SPI interface.
+
+    Replaces one gpiozero MCP3008 object per channel: the request frames are built once
+    and the conversions are decoded inline into a preallocated array.
+    """
+
+    # 10 bit resolution
+    MAX_VALUE = 1023
+
+    def __init__(self, channels, **spi_args):
+        # MCP3008 single ended request: start bit, SGL/DIFF=1, D2..D0 channel select
+        self._frames = [[0x01, (0x08 | channel) << 4, 0x00] for channel in channels]
+        self._values = array("d", [0.0] * len(self._frames))
+        super(MCP3008Bank, self).__init__(**spi_args)
+
+    def read(self):
+        """Read all the channels of the chip (the returned array is reused by the next read)"""
+        transfer = self._spi.transfer
+        values = self._values
+        for index, frame in enumerate(self._frames):
+            response = transfer(frame)
+            values[index] = (((response[1] & 0x03) << 8) | response[2]) / MCP3008Bank.MAX_VALUE
+
+        return values
+
+    def read_channel(self, index):
+        """Read one channel of the chip"""
+        response = self._spi.transfer(self._frames[index])
+        return (((response[1] & 0x03) << 8) | response[2]) / MCP3008Bank.MAX_VALUE
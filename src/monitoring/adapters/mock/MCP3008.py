@@ -6,6 +6,7 @@
 
 import logging
 
+from array import array
 from time import time
 from monitoring.constants import LOG_ADSENSOR
 
@@ -175,3 +176,43 @@ class PowerMCP3008(PatternBasedMockMCP3008):
     def __init__(self, *args, **kwargs):
         super(PowerMCP3008, self).__init__(*args, **kwargs)
         self._alert_source = PowerMCP3008.POWER_ALERT
+
+
+class PatternBasedMockMCP3008Bank(object):
+    """
+    Mock of the batched MCP3008 reader: all the channels of the chip step on the same clock.
+    """
+
+    def __init__(self, channels=None, clock_pin=None, mosi_pin=None, miso_pin=None, select_pin=None):
+        self._channels = list(channels)
+        self._values = array("d", [0.0] * len(self._channels))
+        self._logger = logging.getLogger(LOG_ADSENSOR)
+        self._alert_source = []
+        # clock
+        self.i = 0
+        self._logger.debug("Created mock MCP3008 %s on channels: %s", self.__class__.__name__, self._channels)
+
+    def read(self):
+        try:
+            pattern = self._alert_source[self.i]
+        except IndexError:
+            pattern = []
+
+        for index, channel in enumerate(self._channels):
+            self._values[index] = pattern[channel] if channel < len(pattern) else 0
+
+        # step clock
+        self.i += 1
+        if self.i >= len(self._alert_source):
+            self.i = 0
+
+        return self._values
+
+    def read_channel(self, index):
+        return self.read()[index]
+
+
+class DoubleAlertMCP3008Bank(PatternBasedMockMCP3008Bank):
+    def __init__(self, *args, **kwargs):
+        super(DoubleAlertMCP3008Bank, self).__init__(*args, **kwargs)
+        self._alert_source = DoubleAlertMCP3008.DOUBLE_ALERT
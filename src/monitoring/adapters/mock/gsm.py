@@ -5,34 +5,54 @@
 # @Last Modified time: 2021-02-25 20:09:57
 
 import logging
-import os
 
 from monitoring.constants import LOG_ADGSM
 
 
 class GSM(object):
-    def __init__(self):
+    """
+    Simulated GSM modem with the same interface as the real one.
+
+    signal_strength: the signal strength reported by the modem (-1: no network)
+    failures: number of the next SMS failing to send
+    """
+
+    CONNECTED = "connected"
+    RETRY = "retry"
+    FAILED = "failed"
+
+    def __init__(self, signal_strength=20, failures=0):
         self._logger = logging.getLogger(LOG_ADGSM)
-        self._options = None
+        self._connected = False
+        self.signal_strength = signal_strength
+        self.failures = failures
+        # the sent messages: [(phone number, message)]
+        self.sent_messages = []
 
-    def setup(self):
-        self._options = {}
-        self._options["pin_code"] = "4321"
-        self._options["port"] = os.environ["GSM_PORT"]
-        self._options["baud"] = os.environ["GSM_PORT_BAUD"]
+    @property
+    def connected(self):
+        return self._connected
 
-        self._logger.info(
-            "Connecting to GSM modem on %s with %s baud (PIN: %s)...",
-            self._options["port"],
-            self._options["baud"],
-            self._options["pin_code"],
-        )
+    def connect(self, port, baud, pin_code):
+        self._logger.info("Connecting to GSM modem on %s with %s baud (PIN: %s)...", port, baud, pin_code)
+        self._connected = True
+        return GSM.CONNECTED
 
-        return True
+    def close(self):
+        self._connected = False
 
-    def destroy(self):
-        pass
+    def get_signal_strength(self):
+        return self.signal_strength if self._connected else None
 
     def sendSMS(self, phone_number, message):
+        if not self._connected or message is None:
+            return False
+
+        if self.failures > 0:
+            self.failures -= 1
+            self._logger.info('Failed to send message to %s: "%s"', phone_number, message)
+            return False
+
+        self.sent_messages.append((phone_number, message))
         self._logger.info('Message sent to %s: "%s"', phone_number, message)
         return True
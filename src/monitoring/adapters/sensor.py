@@ -6,16 +6,16 @@
 
 import os
 import logging
+from array import array
 
 from monitoring.adapters import SPI_CLK, SPI_MISO, SPI_MOSI
 from monitoring.constants import LOG_ADSENSOR
 
 # check if running on Raspberry
 if os.uname()[4][:3] == "arm":
-    from gpiozero import MCP3008
+    from monitoring.adapters.mcp3008 import MCP3008Bank
 else:
-    # from monitoring.adapters.mock import TimeBasedMockMCP3008 as MCP3008
-    from monitoring.adapters.mock.MCP3008 import DoubleAlertMCP3008 as MCP3008
+    from monitoring.adapters.mock.MCP3008 import DoubleAlertMCP3008Bank as MCP3008Bank
 
 
 class SensorAdapter(object):
@@ -30,43 +30,58 @@ class SensorAdapter(object):
     IO_NUMBER = int(os.environ["INPUT_NUMBER"])
 
     def __init__(self):
-        self._channels = []
+        # (index of the first channel, reader of the chip)
+        self._banks = []
+        self._values = array("d", [0.0] * SensorAdapter.IO_NUMBER)
         self._logger = logging.getLogger(LOG_ADSENSOR)
 
-        for i in range(SensorAdapter.IO_NUMBER):
+        for index, select_pin in enumerate(SensorAdapter.SPI_CS):
+            first_channel = index * SensorAdapter.CHANNEL_COUNT
+            channels = range(min(SensorAdapter.CHANNEL_COUNT, SensorAdapter.IO_NUMBER - first_channel))
+            if not channels:
+                break
+
             self._logger.debug(
-                "Channel (index:{:2} channel:{:2}<=CH{:0>2} on BCM{:0>2} ({})) creating...".format(
-                    i,
-                    i % SensorAdapter.CHANNEL_COUNT,
-                    i + 1,
-                    SensorAdapter.SPI_CS[i // SensorAdapter.CHANNEL_COUNT],
-                    MCP3008.__name__,
+                "Channels (CH{:0>2}..CH{:0>2} on BCM{:0>2} ({})) creating...".format(
+                    first_channel + 1,
+                    first_channel + len(channels),
+                    select_pin,
+                    MCP3008Bank.__name__,
                 )
             )
-            self._channels.append(
-                MCP3008(
-                    channel=i % SensorAdapter.CHANNEL_COUNT,
-                    clock_pin=SPI_CLK,
-                    mosi_pin=SPI_MOSI,
-                    miso_pin=SPI_MISO,
-                    select_pin=SensorAdapter.SPI_CS[i // SensorAdapter.CHANNEL_COUNT],
+            self._banks.append(
+                (
+                    first_channel,
+                    MCP3008Bank(
+                        channels=channels,
+                        clock_pin=SPI_CLK,
+                        mosi_pin=SPI_MOSI,
+                        miso_pin=SPI_MISO,
+                        select_pin=select_pin,
+                    ),
                 )
             )
 
     def get_value(self, channel):
         """Get the value from one channel"""
-        if 0 <= channel <= 14:
+        if 0 <= channel < SensorAdapter.IO_NUMBER:
             # !!! channel numbering correction board numbering CH1..CH15 => array 0..14
-            return self._channels[channel].value
+            first_channel, bank = self._banks[channel // SensorAdapter.CHANNEL_COUNT]
+            return bank.read_channel(channel - first_channel)
         else:
             return 0
 
     def get_values(self):
-        """Get the values from all the channels"""
-        values = []
-        for channel in self._channels:
-            values.append(channel.value)
-        return values
+        """
+        Get the values from all the channels reading the chips in one burst.
+        The returned array is reused by the next call (copy it to keep the values).
+        """
+        for first_channel, bank in self._banks:
+            values = bank.read()
+            last_channel = first_channel + len(values)
+            self._values[first_channel:last_channel] = values
+
+        return self._values
 
     @property
     def channel_count(self):
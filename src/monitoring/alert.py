@@ -23,9 +23,15 @@ from multiprocessing import Queue
 from queue import Empty
 
 
-class SensorAlert(Thread):
+def describe_sensors(alert_sensors):
+    return [f"{item.sensor.description}(id:{item.sensor.id}/CH{item.sensor.channel+1})" for item in alert_sensors]
+
+
+class SensorAlert(object):
     """
     Handling of alerts from sensors and trigger syren alert.
+
+    The delay of the alert is a timer executed by the monitor.
     """
 
     _sensor_queue = Queue()
@@ -34,35 +40,55 @@ class SensorAlert(Thread):
         """
         Constructor
         """
-        super(SensorAlert, self).__init__(name=THREAD_ALERT)
         self._logger = logging.getLogger(LOG_ALERT)
         self._sensor_id = sensor_id
         self._delay = delay
         self._alert_type = alert_type
         self._stop_event = stop_event
+        self._timers = None
+        self._timer = None
 
-    def run(self):
+    @property
+    def alert_type(self):
+        return self._alert_type
+
+    @property
+    def waiting(self):
+        """True if the delay is not over and not stopped"""
+        return self._timer is not None and not self._timer.cancelled
+
+    def start(self, timers):
         self._logger.info(
             "Alert (%s) started on sensor (id:%s) waiting %s sec before starting syren",
             self._alert_type,
             self._sensor_id,
             self._delay,
         )
-        if not self._stop_event.wait(self._delay):
-            self._logger.info(
-                "Start syren because not disarmed (%s) sensor (id:%s) in %s secs",
-                self._alert_type,
-                self._sensor_id,
-                self._delay,
-            )
-            SyrenAlert.start_syren(self._alert_type, SensorAlert._sensor_queue, self._stop_event)
-            SensorAlert._sensor_queue.put(self._sensor_id)
-            if self._alert_type == ALERT_SABOTAGE:
-                storage.set(storage.MONITORING_STATE, MONITORING_SABOTAGE)
-                send_system_state_change(MONITORING_SABOTAGE)
-        else:
+        self._timers = timers
+        self._timer = timers.schedule(self._delay, self.start_syren)
+
+    def stop(self):
+        if self._timer and not self._timer.cancelled:
+            self._timers.cancel(self._timer)
             self._logger.info("Sensor alert stopped")
 
+    def start_syren(self):
+        if self._stop_event.is_set():
+            self._logger.info("Alert already stopped on sensor (id:%s)", self._sensor_id)
+            return
+
+        self._logger.info(
+            "Start syren because not disarmed (%s) sensor (id:%s) in %s secs",
+            self._alert_type,
+            self._sensor_id,
+            self._delay,
+        )
+        SyrenAlert.start_syren(self._alert_type, SensorAlert._sensor_queue, self._stop_event)
+        SensorAlert._sensor_queue.put(self._sensor_id)
+        if self._alert_type == ALERT_SABOTAGE:
+            storage.set(storage.MONITORING_STATE, MONITORING_SABOTAGE)
+            send_system_state_change(MONITORING_SABOTAGE)
+
 
 class SyrenAlert(Thread):
     """
@@ -96,6 +122,8 @@ class SyrenAlert(Thread):
         self._logger = logging.getLogger(LOG_ALERT)
         self._syren = SyrenAdapter()
         self._alert = None
+        # ids of the sensors added to the alert
+        self._sensor_ids = set()
         self._db_session = None
 
     def run(self):
@@ -124,7 +152,7 @@ class SyrenAlert(Thread):
                 send_syren_state(sysren_is_on)
                 self._logger.info("Syren started")
 
-            self.handle_sensors()
+            self.notify_sensors(self.handle_sensors())
 
         self.stop_alert()
         self._db_session.close()
@@ -152,20 +180,14 @@ class SyrenAlert(Thread):
         send_syren_state(True)
 
         self._logger.debug("Alerting sensors: %s", self._alert.sensors)
-        sensor_descriptions = list(
-            map(
-                lambda item: f"{item.sensor.description}(id:{item.sensor.id}/CH{item.sensor.channel+1})",
-                self._alert.sensors,
-            )
-        )
-        Notifier.notify_alert_started(self._alert.id, sensor_descriptions, start_time)
+        Notifier.notify_alert_started(self._alert.id, describe_sensors(self._alert.sensors), start_time)
 
         self._logger.info("Alert started")
 
     def stop_alert(self):
         with SyrenAlert._semaphore:
             SyrenAlert._alert = None
-            self.handle_sensors()
+            self.notify_sensors(self.handle_sensors())
             self._alert.end_time = datetime.now(pytz.timezone("CET"))
             self._db_session.commit()
 
@@ -176,34 +198,41 @@ class SyrenAlert(Thread):
 
         self._logger.info("Alert stopped")
 
+    def notify_sensors(self, alert_sensors):
+        """Notify about the sensors added to the started alert"""
+        if alert_sensors:
+            Notifier.notify_alert_sensors(
+                self._alert.id, describe_sensors(alert_sensors), datetime.now(pytz.timezone("CET"))
+            )
+
     def handle_sensors(self):
-        sensor_added = False
+        """Add the alerting sensors to the alert and return the added ones"""
+        sensor_ids = set()
         try:
             while True:
-                sensor_id = self._sensor_queue.get(False)
-                sensor = self._db_session.query(Sensor).get(sensor_id)
-
-                # check if already added to the alert
-                already_added = False
-                for alert_sensor in self._alert.sensors:
-                    if alert_sensor.sensor.id == sensor.id:
-                        already_added = True
-
-                if not already_added:
-                    alert_sensor = AlertSensor(
-                        channel=sensor.channel, type_id=sensor.type_id, description=sensor.description
-                    )
-                    alert_sensor.sensor = sensor
-                    self._alert.sensors.append(alert_sensor)
-                    sensor_added = True
-                    self._logger.debug("Added sensor by id: %s", sensor_id)
-                else:
-                    self._logger.debug("Sensor by id: %s already added", sensor_id)
+                sensor_ids.add(self._sensor_queue.get(False))
         except Empty:
             pass
 
-        if sensor_added:
+        # check if already added to the alert
+        if sensor_ids & self._sensor_ids:
+            self._logger.debug("Sensors by id: %s already added", sensor_ids & self._sensor_ids)
+            sensor_ids -= self._sensor_ids
+        if not sensor_ids:
+            return []
+
+        added_sensors = []
+        for sensor in self._db_session.query(Sensor).filter(Sensor.id.in_(sensor_ids)).all():
+            alert_sensor = AlertSensor(channel=sensor.channel, type_id=sensor.type_id, description=sensor.description)
+            alert_sensor.sensor = sensor
+            added_sensors.append(alert_sensor)
+            self._sensor_ids.add(sensor.id)
+
+        if added_sensors:
+            # inserted together by the commit
+            self._alert.sensors.extend(added_sensors)
             self._db_session.commit()
+            self._logger.debug("Added sensors by id: %s", [item.sensor.id for item in added_sensors])
             send_alert_state(self._alert.serialize)
 
-        return sensor_added
+        return added_sensors
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from time import monotonic
+
+
+class Cadence(object):
+    """
+    Fixed rate timing of the sampling cycles on the monotonic clock.
+
+    The deadlines are calculated from the start, so the time spent in a cycle
+    doesn't shift the following cycles. If a cycle starts later than one period
+    the missed deadlines are skipped and counted as overrun.
+    """
+
+    def __init__(self, rate):
+        self._period = 1 / rate
+        self._deadline = None
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+
+    def start(self):
+        """Start the timing with a cycle due immediately"""
+        self._deadline = monotonic()
+
+    def remaining(self):
+        """Seconds left until the next cycle is due"""
+        return max(0.0, self._deadline - monotonic())
+
+    def tick(self):
+        """Register the start of a cycle and return its lag behind the deadline"""
+        lag = monotonic() - self._deadline
+        self.cycles += 1
+        self.max_lag = max(self.max_lag, lag)
+
+        missed = int(lag // self._period) if lag > 0 else 0
+        if missed:
+            self.overruns += 1
+            self.skipped += missed
+
+        self._deadline += (missed + 1) * self._period
+        return lag
+
+    @property
+    def statistics(self):
+        return {
+            "cycles": self.cycles,
+            "overruns": self.overruns,
+            "skipped": self.skipped,
+            "max_lag": round(self.max_lag, 4),
+        }
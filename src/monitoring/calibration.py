@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# @Description: Measuring and following the reference values of the sensors.
+#   Both are fed with the values of the channels in the sampling cycles of the monitor,
+#   so the monitor never waits for them.
+from array import array
+from math import isnan
+
+REASON_CALIBRATION = "calibration"
+REASON_ADAPTATION = "adaptation"
+
+
+class Calibration(object):
+    """Average of the values of the channels in the given number of sampling cycles"""
+
+    def __init__(self, channels, samples):
+        self._sums = array("d", [0.0] * channels)
+        self._samples = max(1, samples)
+        self._count = 0
+
+    @property
+    def done(self):
+        return self._count >= self._samples
+
+    def add(self, values):
+        """Add the values of one sampling cycle and return True if the measurement is finished"""
+        for channel in range(len(self._sums)):
+            self._sums[channel] += values[channel]
+        self._count += 1
+        return self.done
+
+    @property
+    def references(self):
+        return [value_sum / self._count for value_sum in self._sums]
+
+
+class ReferenceTracker(object):
+    """
+    Follow the slow drift of the reference values (ex. temperature) with exponentially weighted moving average.
+
+    Only the values of the quiet channels (closer to the reference than the quiet tolerance) are used
+    and the reference can't move farther from the calibrated value than the maximum drift.
+    """
+
+    def __init__(self, alpha, quiet_tolerance, max_drift):
+        self._alpha = alpha
+        self._quiet_tolerance = quiet_tolerance
+        self._max_drift = max_drift
+        # same order as the references
+        self._calibrated = array("d")
+        self._saved = array("d")
+
+    def reset(self, references, calibrated):
+        """Start tracking the references (and the calibrated values) of the loaded sensors"""
+        self._calibrated = array("d", calibrated)
+        self._saved = array("d", references)
+
+    def calibrated(self, index):
+        return self._calibrated[index]
+
+    def set_calibrated(self, index, value):
+        self._calibrated[index] = value
+        self._saved[index] = value
+
+    def update(self, references, values, channels, alerting):
+        """Move the references of the quiet sensors towards the measured values (in place)"""
+        if not self._alpha:
+            return
+
+        for index, (reference, channel, alert, calibrated) in enumerate(
+            zip(references, channels, alerting, self._calibrated)
+        ):
+            if alert or isnan(reference):
+                continue
+
+            deviation = values[channel] - reference
+            if abs(deviation) >= self._quiet_tolerance:
+                continue
+
+            reference += self._alpha * deviation
+            references[index] = min(max(reference, calibrated - self._max_drift), calibrated + self._max_drift)
+
+    def take_changes(self, references, minimum_change):
+        """Return the (index, saved value, new value) of the references changed at least the minimum"""
+        changes = []
+        for index, (reference, saved) in enumerate(zip(references, self._saved)):
+            if not isnan(reference) and abs(reference - saved) >= minimum_change:
+                changes.append((index, saved, reference))
+                self._saved[index] = reference
+
+        return changes
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# @Description: Loading the configuration of the sensors in the background.
+#   The loader prepares a new sensor table and the monitor swaps it in at the start of a sampling cycle,
+#   so the sensors are scanned with the old table until the new one is ready.
+import logging
+from array import array
+from collections import namedtuple
+from math import nan
+from threading import Event, Lock, Thread
+from time import sleep
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
+
+from models import Sensor, SensorFilter, SensorReference
+from monitoring.constants import LOG_LOADER, THREAD_LOADER
+from monitoring.database import Session
+from monitoring.filters import create_filter, select_filter_settings
+
+# seconds before retrying a failed loading
+RETRY_PERIOD = 5
+
+
+class SensorSnapshot(object):
+    """Read-only copy of the sensor with the alert delays of its zone (no database access after loading)"""
+
+    __slots__ = (
+        "id",
+        "channel",
+        "enabled",
+        "description",
+        "type_id",
+        "zone_id",
+        "disarmed_delay",
+        "away_delay",
+        "stay_delay",
+    )
+
+    def __init__(self, sensor):
+        for name, value in (
+            ("id", sensor.id),
+            ("channel", sensor.channel),
+            ("enabled", bool(sensor.enabled)),
+            ("description", sensor.description),
+            ("type_id", sensor.type_id),
+            ("zone_id", sensor.zone_id),
+            ("disarmed_delay", sensor.zone.disarmed_delay),
+            ("away_delay", sensor.zone.away_delay),
+            ("stay_delay", sensor.zone.stay_delay),
+        ):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Sensor snapshot is read-only ({name})")
+
+    def __repr__(self):
+        return f"SensorSnapshot(id={self.id}, channel={self.channel})"
+
+
+# Configuration of the monitored sensors (the arrays are in the order of the sensors).
+#   sensors: snapshots of the sensors
+#   valid: False if the configuration can't be monitored (the table is empty)
+#   calibrate: True if there are sensors without reference value
+#   references: reference values from the database (nan if not initialized)
+#   calibrated: reference values of the last calibration
+SensorTable = namedtuple(
+    "SensorTable",
+    ("valid", "calibrate", "sensors", "sensor_ids", "channels", "references", "calibrated", "enabled", "filters"),
+)
+
+
+def build_sensor_table(sensors, filter_settings, sensor_references, channel_count, tolerance):
+    """Validate the configuration and create the sensor table"""
+    logger = logging.getLogger(LOG_LOADER)
+    if len(sensors) > channel_count:
+        logger.info("Invalid number of sensors to monitor (Found=%s > Max=%s)", len(sensors), channel_count)
+        return build_sensor_table([], [], {}, channel_count, tolerance)._replace(valid=False)
+
+    channels = [sensor.channel for sensor in sensors]
+    if len(set(channels)) != len(channels):
+        logger.info("Invalid channel configuration")
+        logger.debug("Channels: %s", channels)
+        return build_sensor_table([], [], {}, channel_count, tolerance)._replace(valid=False)
+
+    references = [nan if sensor.reference_value is None else sensor.reference_value for sensor in sensors]
+    calibrated = [
+        sensor_references[sensor.id].calibrated_value if sensor.id in sensor_references else reference
+        for sensor, reference in zip(sensors, references)
+    ]
+    return SensorTable(
+        valid=True,
+        calibrate=any(sensor.reference_value is None for sensor in sensors),
+        sensors=tuple(SensorSnapshot(sensor) for sensor in sensors),
+        sensor_ids=array("i", [sensor.id for sensor in sensors]),
+        channels=array("i", channels),
+        references=array("d", references),
+        calibrated=array("d", calibrated),
+        enabled=array("b", [bool(sensor.enabled) for sensor in sensors]),
+        filters=tuple(
+            create_filter(select_filter_settings(sensor, filter_settings), tolerance) for sensor in sensors
+        ),
+    )
+
+
+class ConfigurationLoader(Thread):
+    """Load the sensor table from the database when requested"""
+
+    def __init__(self, channel_count, tolerance):
+        super(ConfigurationLoader, self).__init__(name=THREAD_LOADER, daemon=True)
+        self._logger = logging.getLogger(LOG_LOADER)
+        self._channel_count = channel_count
+        self._tolerance = tolerance
+        self._reload = Event()
+        self._stop_event = Event()
+        self._lock = Lock()
+        self._table = None
+
+    def reload(self):
+        """Request loading the configuration (the requests during loading result one more loading)"""
+        self._reload.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._reload.set()
+
+    def take_table(self):
+        """Return the new sensor table once (None if not loaded yet)"""
+        with self._lock:
+            table, self._table = self._table, None
+
+        return table
+
+    def run(self):
+        self._logger.info("Configuration loader started")
+        while True:
+            self._reload.wait()
+            if self._stop_event.is_set():
+                break
+
+            self._reload.clear()
+            try:
+                table = self.load()
+            except SQLAlchemyError:
+                self._logger.exception("Failed to load the configuration, retry...")
+                sleep(RETRY_PERIOD)
+                self._reload.set()
+                continue
+            except Exception:
+                # the monitor leaves the updating state with the invalid configuration
+                self._logger.exception("Failed to load the configuration!")
+                table = build_sensor_table([], [], {}, self._channel_count, self._tolerance)._replace(valid=False)
+
+            with self._lock:
+                self._table = table
+            self._logger.debug("Sensors reloaded!")
+
+        Session.remove()
+        self._logger.info("Configuration loader stopped")
+
+    def load(self):
+        db_session = Session()
+        try:
+            sensors = (
+                db_session.query(Sensor)
+                .options(joinedload(Sensor.zone))
+                .filter_by(deleted=False)
+                .order_by(Sensor.channel)
+                .all()
+            )
+            filter_settings = db_session.query(SensorFilter).all()
+            # the last audit record of the references (with the calibrated values)
+            sensor_references = {
+                reference.sensor_id: reference
+                for reference in db_session.query(SensorReference)
+                .distinct(SensorReference.sensor_id)
+                .order_by(SensorReference.sensor_id, SensorReference.time.desc())
+            }
+        finally:
+            # only the snapshots of the loaded records are used by the monitor thread
+            db_session.close()
+
+        return build_sensor_table(sensors, filter_settings, sensor_references, self._channel_count, self._tolerance)
@@ -16,6 +16,10 @@ THREAD_SOCKETIO = "SocketIO"
 THREAD_ALERT = "Alert"
 THREAD_KEYPAD = "Keypad"
 THREAD_SECCON = "SecCon"
+THREAD_PERSISTER = "Persister"
+THREAD_RECORDER = "Recorder"
+THREAD_LOADER = "Loader"
+THREAD_GSM = "GSM"
 
 LOG_SERVICE = THREAD_SERVICE
 LOG_MONITOR = THREAD_MONITOR
@@ -33,6 +37,9 @@ LOG_SC_CERTBOT = "SC.CertBot"
 LOG_SC_DYNDNS = "SC.DynDns"
 LOG_SC_ACCESS = "SC.Access"
 LOG_CLOCK = "Clock"
+LOG_PERSISTER = THREAD_PERSISTER
+LOG_RECORDER = THREAD_RECORDER
+LOG_LOADER = THREAD_LOADER
 
 LOGGING_MODULES = [
     (LOG_SERVICE, INFO),
@@ -50,6 +57,9 @@ LOGGING_MODULES = [
     (LOG_SC_DYNDNS, INFO),
     (LOG_SC_ACCESS, INFO),
     (LOG_CLOCK, INFO),
+    (LOG_PERSISTER, INFO),
+    (LOG_RECORDER, INFO),
+    (LOG_LOADER, INFO),
 ]
 
 # INTERNAL CONSTANTS
@@ -64,6 +74,8 @@ MONITOR_UPDATE_KEYPAD = "monitor_update_keypad"
 MONITOR_STOP = "monitor_stop"
 MONITOR_SYNC_CLOCK = "monitor_sync_clock"
 MONITOR_SET_CLOCK = "monitor_set_clock"
+MONITOR_GET_JOB = "monitor_get_job"
+MONITOR_GET_VERSIONS = "monitor_get_versions"
 
 UPDATE_SECURE_CONNECTION = "monitor_update_secure_connection"
 POWER_GET_STATE = "power_get_state"
@@ -94,6 +106,12 @@ MONITORING_ARMED = "monitoring_armed"
 MONITORING_SABOTAGE = "monitoring_sabotage"
 MONITORING_ERROR = "monitoring_error"
 
+# states of the maintenance jobs
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
 POWER_SOURCE_NETWORK = "network"
 POWER_SOURCE_BATTERY = "battery"
 
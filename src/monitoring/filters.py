@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# @Description: Filters between the sensor readings and the alert state of the sensors.
+#   Filter.process(value, reference, alert) receives the value of the channel, the reference value
+#   and the current alert state of the sensor and returns the new alert state.
+
+from collections import deque
+
+
+class ThresholdFilter(object):
+    """Alert if the value is not closer to the reference than the tolerance"""
+
+    __slots__ = ("tolerance",)
+
+    def __init__(self, tolerance):
+        self.tolerance = tolerance
+
+    def process(self, value, reference, alert):
+        return not abs(value - reference) < self.tolerance
+
+
+class DebounceFilter(object):
+    """
+    Filter the noise of the readings:
+     * moving average of the last values (average_window)
+     * hysteresis: alert starts above the enter tolerance and stops below the exit tolerance
+     * debounce: the state changes if N (threshold) of the last M (samples) readings confirm the change
+    """
+
+    __slots__ = ("enter_tolerance", "exit_tolerance", "threshold", "_mask", "_history", "_window", "_sum")
+
+    def __init__(self, enter_tolerance, exit_tolerance, samples=1, threshold=1, average_window=1):
+        self.enter_tolerance = enter_tolerance
+        self.exit_tolerance = min(exit_tolerance, enter_tolerance)
+        self.threshold = max(1, min(threshold, samples))
+        # confirmations of the state change of the last readings as bits
+        self._mask = (1 << max(1, samples)) - 1
+        self._history = 0
+        self._window = deque(maxlen=average_window) if average_window > 1 else None
+        self._sum = 0.0
+
+    def process(self, value, reference, alert):
+        if self._window is not None:
+            if len(self._window) == self._window.maxlen:
+                self._sum -= self._window[0]
+            self._window.append(value)
+            self._sum += value
+            value = self._sum / len(self._window)
+
+        deviation = abs(value - reference)
+        if alert:
+            confirmed = deviation < self.exit_tolerance
+        else:
+            confirmed = not deviation < self.enter_tolerance
+
+        self._history = ((self._history << 1) | confirmed) & self._mask
+        if bin(self._history).count("1") >= self.threshold:
+            self._history = 0
+            return not alert
+
+        return alert
+
+
+def select_filter_settings(sensor, filter_settings):
+    """
+    Find the most specific filter settings of the sensor:
+    zone and sensor type > zone > sensor type > general settings
+    """
+    selected = None
+    selected_rank = -1
+    for settings in filter_settings:
+        if settings.zone_id not in (None, sensor.zone_id) or settings.type_id not in (None, sensor.type_id):
+            continue
+
+        rank = (2 if settings.zone_id is not None else 0) + (1 if settings.type_id is not None else 0)
+        if rank > selected_rank:
+            selected = settings
+            selected_rank = rank
+
+    return selected
+
+
+def create_filter(settings, tolerance):
+    """Create the filter of a sensor from the settings (defaults to a simple threshold)"""
+    if settings is None:
+        return ThresholdFilter(tolerance)
+
+    enter_tolerance = settings.enter_tolerance if settings.enter_tolerance is not None else tolerance
+    exit_tolerance = settings.exit_tolerance if settings.exit_tolerance is not None else enter_tolerance
+    samples = settings.samples or 1
+    threshold = settings.threshold or 1
+    average_window = settings.average_window or 1
+
+    if exit_tolerance == enter_tolerance and samples == 1 and average_window == 1:
+        return ThresholdFilter(enter_tolerance)
+
+    return DebounceFilter(enter_tolerance, exit_tolerance, samples, threshold, average_window)
@@ -4,14 +4,22 @@
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:07:45
 
-import json
 import logging
 import socket
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from uuid import uuid4
 from os import chmod, chown, environ, makedirs, path, remove
-from threading import Thread
+from threading import Lock, Thread
+from time import monotonic
 
 from monitoring import storage
 from monitoring.constants import (
+    JOB_DONE,
+    JOB_FAILED,
+    JOB_PENDING,
+    JOB_RUNNING,
     LOG_IPC,
     MONITOR_ARM_AWAY,
     MONITOR_ARM_STAY,
@@ -25,13 +33,24 @@ from monitoring.constants import (
     THREAD_IPC,
     MONITOR_GET_ARM,
     MONITOR_GET_STATE,
+    MONITOR_GET_JOB,
+    MONITOR_GET_VERSIONS,
     UPDATE_SSH,
 )
 from tools.clock import Clock
 from tools.connection import SecureConnection
+from tools.ipc import receive_frame, send_frame
 from tools.ssh import SSH
 
 MONITOR_INPUT_SOCKET = environ["MONITOR_INPUT_SOCKET"]
+# number of threads handling the requests
+REQUEST_WORKERS = 4
+# number of finished jobs kept for polling
+JOB_HISTORY = 20
+# maximum seconds to wait for a state change (below the response timeout of the client)
+MAX_STATE_WAIT = 25
+# the versions are counted from the start of the service
+BOOT_ID = uuid4().hex[:8]
 
 
 class IPCServer(Thread):
@@ -47,6 +66,18 @@ class IPCServer(Thread):
         self._logger = logging.getLogger(LOG_IPC)
         self._stop_event = stop_event
         self._broadcaster = broadcaster
+        self._connections = set()
+        self._connections_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix=THREAD_IPC)
+        # maintenance jobs run one by one off the request path
+        self._job_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=THREAD_IPC)
+        self._jobs = OrderedDict()
+        self._jobs_lock = Lock()
+        self._job_ids = count(1)
+        # long polling requests waiting for a state change: [(deadline, connection, send_lock, request_id)]
+        self._state_waiters = []
+        self._state_waiters_lock = Lock()
+        storage.subscribe(self.on_state_change)
         self._initialize_socket()
         self._logger.info("IPC server created")
 
@@ -61,7 +92,7 @@ class IPCServer(Thread):
 
         self.create_socket_file()
         self._socket.bind(MONITOR_INPUT_SOCKET)
-        self._socket.listen(1)
+        self._socket.listen(8)
 
         try:
             chmod(MONITOR_INPUT_SOCKET, int(environ["PERMISSIONS"], 8))
@@ -98,23 +129,43 @@ class IPCServer(Thread):
         elif message["action"] == MONITOR_GET_ARM:
             return_value["value"] = {"type": storage.get(storage.ARM_STATE)}
         elif message["action"] == MONITOR_GET_STATE:
-            return_value["value"] = {"state": storage.get(storage.MONITORING_STATE)}
+            return_value["value"] = self.get_state()
         elif message["action"] == MONITOR_UPDATE_CONFIG:
             self._logger.info("Update configuration...")
+            storage.increment(storage.CONFIGURATION_VERSION)
             self._broadcaster.send_message(MONITOR_UPDATE_CONFIG)
         elif message["action"] == MONITOR_UPDATE_KEYPAD:
             self._logger.info("Update keypad...")
+            storage.increment(storage.CONFIGURATION_VERSION)
             self._broadcaster.send_message(MONITOR_UPDATE_KEYPAD)
+        elif message["action"] == MONITOR_GET_VERSIONS:
+            return_value["value"] = {
+                "boot": BOOT_ID,
+                "configuration": storage.get_counter(storage.CONFIGURATION_VERSION),
+                "sensors": storage.get_counter(storage.SENSORS_VERSION),
+            }
         elif message["action"] == UPDATE_SECURE_CONNECTION:
             self._logger.info("Update secure connection...")
-            SecureConnection(self._stop_event).run()
+            return_value["value"] = {
+                "job": self.start_job(UPDATE_SECURE_CONNECTION, SecureConnection(self._stop_event).run)
+            }
         elif message["action"] == UPDATE_SSH:
             self._logger.info("Update ssh connection...")
-            SSH().update_ssh_service()
+            return_value["value"] = {"job": self.start_job(UPDATE_SSH, SSH().update_ssh_service)}
         elif message["action"] == MONITOR_SYNC_CLOCK:
-            if not Clock().sync_clock():
+            return_value["value"] = {
+                "job": self.start_job(MONITOR_SYNC_CLOCK, Clock().sync_clock, "Failed to sync time")
+            }
+        elif message["action"] == MONITOR_GET_JOB:
+            with self._jobs_lock:
+                job = self._jobs.get(message.get("job_id"))
+                job = dict(job) if job else None
+
+            if job:
+                return_value["value"] = job
+            else:
                 return_value["result"] = False
-                return_value["message"] = "Failed to sync time"
+                return_value["message"] = "Unknown job"
         elif message["action"] == MONITOR_SET_CLOCK:
             if not Clock().set_clock(message):
                 return_value["result"] = False
@@ -127,33 +178,150 @@ class IPCServer(Thread):
 
         return return_value
 
+    def get_state(self):
+        version, data = storage.snapshot()
+        return {
+            "state": data.get(storage.MONITORING_STATE),
+            "arm": data.get(storage.ARM_STATE),
+            "power": data.get(storage.POWER_STATE),
+            "version": version,
+        }
+
+    def wait_for_state(self, connection, send_lock, request_id, version, timeout):
+        """Register the long polling request, return False if the state is already newer"""
+        deadline = monotonic() + min(timeout, MAX_STATE_WAIT)
+        with self._state_waiters_lock:
+            if storage.get_version() != version:
+                return False
+
+            self._state_waiters.append((deadline, connection, send_lock, request_id))
+            return True
+
+    def on_state_change(self, version, key, value):
+        """Storage subscriber: answer the waiting requests (from the thread pool)"""
+        with self._state_waiters_lock:
+            waiters, self._state_waiters = self._state_waiters, []
+
+        if waiters:
+            self._executor.submit(self.answer_state_waiters, waiters)
+
+    def expire_state_waiters(self):
+        now = monotonic()
+        with self._state_waiters_lock:
+            expired = [waiter for waiter in self._state_waiters if waiter[0] <= now]
+            if not expired:
+                return
+            self._state_waiters = [waiter for waiter in self._state_waiters if waiter[0] > now]
+
+        self.answer_state_waiters(expired)
+
+    def answer_state_waiters(self, waiters):
+        response = {"result": True, "value": self.get_state()}
+        for _, connection, send_lock, request_id in waiters:
+            self.send_response(connection, send_lock, {**response, "id": request_id})
+
+    def start_job(self, action, function, error_message=None):
+        """
+        Run the (long running) function in the background and return the job to poll.
+        The job fails if the function returns False or raises an exception.
+        """
+        job = {"id": next(self._job_ids), "action": action, "state": JOB_PENDING}
+        with self._jobs_lock:
+            self._jobs[job["id"]] = job
+            # forget the oldest jobs
+            while len(self._jobs) > JOB_HISTORY and next(iter(self._jobs.values()))["state"] in (JOB_DONE, JOB_FAILED):
+                self._jobs.popitem(last=False)
+            started_job = dict(job)
+
+        self._job_executor.submit(self.run_job, job, function, error_message)
+        return started_job
+
+    def run_job(self, job, function, error_message):
+        with self._jobs_lock:
+            job["state"] = JOB_RUNNING
+
+        self._logger.debug("Job started: %s", job)
+        try:
+            succeeded = function() is not False
+        except Exception:
+            self._logger.exception("Job failed: %s", job)
+            succeeded = False
+
+        with self._jobs_lock:
+            job["state"] = JOB_DONE if succeeded else JOB_FAILED
+            if not succeeded:
+                job["message"] = error_message or "Failed to execute the action"
+        self._logger.debug("Job finished: %s", job)
+
     def run(self):
         self._logger.info("IPC server started")
-        # read all the messages
+        # accept the persistent connections of the server processes
         while not self._stop_event.is_set():
-            connection = None
+            self.expire_state_waiters()
             try:
                 connection, _ = self._socket.accept()
             except socket.timeout:
-                pass
+                continue
+
+            connection.settimeout(None)
+            with self._connections_lock:
+                self._connections.add(connection)
+            Thread(target=self.serve_connection, args=(connection,), name=THREAD_IPC, daemon=True).start()
+
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+        storage.unsubscribe(self.on_state_change)
+        self._executor.shutdown(wait=False)
+        self._job_executor.shutdown(wait=False)
 
-            # read all the parts of a messages
-            while connection:
-                data = connection.recv(1024)
+        self._logger.info("IPC server stopped")
 
-                if not data:
+    def serve_connection(self, connection):
+        """Read the requests of a connection and handle them in the thread pool"""
+        self._logger.debug("IPC connection opened")
+        send_lock = Lock()
+        try:
+            while not self._stop_event.is_set():
+                message = receive_frame(connection)
+                if message is None:
                     break
 
-                self._logger.debug("Received action: '%s'", data)
+                self._logger.debug("Received action: '%s'", message)
+                self._executor.submit(self.handle_request, connection, send_lock, message)
+        except (OSError, ValueError) as error:
+            self._logger.debug("IPC connection failed: %s", error)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(connection)
+            connection.close()
 
-                response = self.handle_actions(json.loads(data.decode()))
+        self._logger.debug("IPC connection closed")
 
-                try:
-                    connection.send(json.dumps(response).encode())
-                except BrokenPipeError:
-                    pass
+    def handle_request(self, connection, send_lock, message):
+        """Execute the request and send the response with the id of the request"""
+        request_id = message.pop("id", None)
+        # long polling: answer when the state changes
+        if (
+            message.get("action") == MONITOR_GET_STATE
+            and message.get("version") is not None
+            and message.get("timeout", 0) > 0
+            and self.wait_for_state(connection, send_lock, request_id, message["version"], message.get("timeout", 0))
+        ):
+            return
 
-            if connection:
-                connection.close()
+        try:
+            response = self.handle_actions(message)
+        except Exception:
+            self._logger.exception("Failed to handle action: %s", message)
+            response = {"result": False, "message": "Failed to execute the action"}
 
-        self._logger.info("IPC server stopped")
+        response["id"] = request_id
+        self.send_response(connection, send_lock, response)
+
+    def send_response(self, connection, send_lock, response):
+        try:
+            with send_lock:
+                send_frame(connection, response)
+        except OSError as error:
+            self._logger.debug("Failed to send response: %s", error)
@@ -3,13 +3,15 @@
 # @Date:   2021-02-25 20:07:34
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:07:37
+from array import array
 from datetime import datetime
 import logging
 
+from math import isnan
 from os import environ
 from queue import Empty
 from threading import Thread, Event
-from time import sleep
+from time import monotonic, sleep
 
 from models import Alert, Sensor
 import monitoring.alert
@@ -17,6 +19,8 @@ import monitoring.alert
 from monitoring import storage
 from monitoring.adapters.power import PowerAdapter
 from monitoring.adapters.sensor import SensorAdapter
+from monitoring.cadence import Cadence
+from monitoring.calibration import REASON_ADAPTATION, REASON_CALIBRATION, Calibration, ReferenceTracker
 from monitoring.constants import (
     POWER_SOURCE_BATTERY,
     POWER_SOURCE_NETWORK,
@@ -41,6 +45,10 @@ from monitoring.constants import (
     ALERT_SABOTAGE,
 )
 from monitoring.database import Session
+from monitoring.configuration import ConfigurationLoader
+from monitoring.persister import AlertPersister
+from monitoring.recorder import SampleRecorder
+from monitoring.timers import TimerQueue
 from monitoring.socket_io import (
     send_power_state_change,
     send_system_state_change,
@@ -51,18 +59,24 @@ from monitoring.socket_io import (
 )
 
 
-MEASUREMENT_CYCLES = 2
-MEASUREMENT_TIME = 3
+# seconds of measuring the reference values
+CALIBRATION_TIME = 6
+# minimum seconds between logging the sampling overruns
+STATISTICS_PERIOD = 60
 TOLERANCE = float(environ["TOLERANCE"])
+# following the drift of the references while disarmed (seconds of the time constant, 0: disabled)
+REFERENCE_TIME_CONSTANT = float(environ.get("REFERENCE_TIME_CONSTANT", 600))
+# maximum distance of the reference from the calibrated value
+REFERENCE_MAX_DRIFT = float(environ.get("REFERENCE_MAX_DRIFT", TOLERANCE / 2))
+# the sensor is quiet if the value is closer to the reference than this part of the tolerance
+REFERENCE_QUIET_RATIO = 0.5
+# seconds between saving the followed references
+REFERENCE_SAVE_PERIOD = 900
 
 # 2000.01.01 00:00:00
 DEFAULT_DATETIME = 946684800
 
 
-def is_close(a, b, tolerance=0.0):
-    return abs(a - b) < tolerance
-
-
 class Monitor(Thread):
     """
     classdocs
@@ -77,12 +91,31 @@ class Monitor(Thread):
         self._sensorAdapter = SensorAdapter()
         self._powerAdapter = PowerAdapter()
         self._actions = actions
-        self._sensors = None
+        self._sensors = ()
+        self._loader = ConfigurationLoader(self._sensorAdapter.channel_count, TOLERANCE)
+        # state of the sensors for the scanning (same order as the sensors)
+        self._sensor_ids = array("i")
+        self._channels = array("i")
+        self._references = array("d")
+        self._enabled = array("b")
+        self._alerting = array("b")
+        self._filters = ()
+        self._calibration = None
+        self._reference_tracker = ReferenceTracker(
+            1 / (REFERENCE_TIME_CONSTANT * int(environ["SAMPLE_RATE"])) if REFERENCE_TIME_CONSTANT else 0,
+            TOLERANCE * REFERENCE_QUIET_RATIO,
+            REFERENCE_MAX_DRIFT,
+        )
         self._db_alert = None
         self._power_source = None
         self._alerts = {}
+        # alerts of the cleared sensors still waiting for the delay (stopped by disarm)
+        self._cleared_alerts = []
+        self._alert_timers = TimerQueue()
         self._stop_alert = Event()
         self._db_session = None
+        self._persister = AlertPersister()
+        self._recorder = SampleRecorder(self._sensorAdapter.channel_count, int(environ["SAMPLE_RATE"]))
 
         self._logger.info("Monitoring created")
         storage.set(storage.MONITORING_STATE, MONITORING_STARTUP)
@@ -97,6 +130,9 @@ class Monitor(Thread):
 
         # remove invalid state items from db before startup
         self.cleanup_database()
+        self._persister.start()
+        self._recorder.start()
+        self._loader.start()
 
         # initialize state
         send_alert_state(None)
@@ -106,51 +142,98 @@ class Monitor(Thread):
 
         self.load_sensors()
 
+        cadence = Cadence(int(environ["SAMPLE_RATE"]))
+        cadence.start()
+        last_report = monotonic()
+        last_reference_save = monotonic()
+        reported_overruns = 0
         while True:
+            # handle the commands while waiting for the next sampling cycle
             try:
-                action = self._actions.get(True, 1 / int(environ["SAMPLE_RATE"]))
-                self._logger.debug("Action: %s" % action)
-                if action == MONITOR_STOP:
+                action = self._actions.get(True, cadence.remaining())
+            except Empty:
+                action = None
+
+            if action is not None:
+                if not self.handle_action(action):
                     break
-                elif action == MONITOR_ARM_AWAY:
-                    storage.set(storage.ARM_STATE, ARM_AWAY)
-                    send_arm_state(ARM_AWAY)
-                    storage.set(storage.MONITORING_STATE, MONITORING_ARMED)
-                    send_system_state_change(MONITORING_ARMED)
-                    self._stop_alert.clear()
-                elif action == MONITOR_ARM_STAY:
-                    storage.set(storage.ARM_STATE, ARM_STAY)
-                    send_arm_state(ARM_STAY)
-                    storage.set(storage.MONITORING_STATE, MONITORING_ARMED)
-                    send_system_state_change(MONITORING_ARMED)
-                    self._stop_alert.clear()
-                elif action == MONITOR_DISARM:
-                    current_state = storage.get(storage.MONITORING_STATE)
-                    current_arm = storage.get(storage.ARM_STATE)
-                    if (
-                        current_state == MONITORING_ARMED
-                        and current_arm in (ARM_AWAY, ARM_STAY)
-                        or current_state == MONITORING_SABOTAGE
-                    ):
-                        storage.set(storage.ARM_STATE, ARM_DISARM)
-                        send_arm_state(ARM_DISARM)
-                        storage.set(storage.MONITORING_STATE, MONITORING_READY)
-                        send_system_state_change(MONITORING_READY)
-                    self._stop_alert.set()
+
+                if cadence.remaining() > 0:
                     continue
-                elif action == MONITOR_UPDATE_CONFIG:
-                    self.load_sensors()
-            except Empty:
-                pass
 
+            cadence.tick()
+            self.swap_sensor_table()
             self.check_power()
-            self.scan_sensors()
+            # read all the channels in one burst
+            values = self._sensorAdapter.get_values()
+            self._recorder.record(values)
+            if self._calibration:
+                self.calibrate_sensors(values)
+            else:
+                self.scan_sensors(values)
+                self.follow_references(values)
             self.handle_alerts()
+            self._alert_timers.run_pending()
+
+            if cadence.overruns > reported_overruns and monotonic() - last_report > STATISTICS_PERIOD:
+                self._logger.warning("Sampling cycles overrun: %s", cadence.statistics)
+                reported_overruns = cadence.overruns
+                last_report = monotonic()
 
+            if monotonic() - last_reference_save > REFERENCE_SAVE_PERIOD:
+                self.save_references()
+                last_reference_save = monotonic()
+
+        self._loader.stop()
         self._stop_alert.set()
+        self._alert_timers.cancel_all()
+        self.save_references()
+        self._persister.stop()
+        self._persister.join()
+        self._recorder.stop()
+        self._recorder.join()
         self._db_session.close()
         self._logger.info("Monitoring stopped")
 
+    def handle_action(self, action):
+        """Execute the command and return False if the monitoring has to stop"""
+        self._logger.debug("Action: %s" % action)
+        if action == MONITOR_STOP:
+            return False
+        elif action == MONITOR_ARM_AWAY:
+            storage.set(storage.ARM_STATE, ARM_AWAY)
+            send_arm_state(ARM_AWAY)
+            storage.set(storage.MONITORING_STATE, MONITORING_ARMED)
+            send_system_state_change(MONITORING_ARMED)
+            self._stop_alert.clear()
+        elif action == MONITOR_ARM_STAY:
+            storage.set(storage.ARM_STATE, ARM_STAY)
+            send_arm_state(ARM_STAY)
+            storage.set(storage.MONITORING_STATE, MONITORING_ARMED)
+            send_system_state_change(MONITORING_ARMED)
+            self._stop_alert.clear()
+        elif action == MONITOR_DISARM:
+            current_state = storage.get(storage.MONITORING_STATE)
+            current_arm = storage.get(storage.ARM_STATE)
+            if (
+                current_state == MONITORING_ARMED
+                and current_arm in (ARM_AWAY, ARM_STAY)
+                or current_state == MONITORING_SABOTAGE
+            ):
+                storage.set(storage.ARM_STATE, ARM_DISARM)
+                send_arm_state(ARM_DISARM)
+                storage.set(storage.MONITORING_STATE, MONITORING_READY)
+                send_system_state_change(MONITORING_READY)
+            self._stop_alert.set()
+            for sensor_alert in list(self._alerts.values()) + self._cleared_alerts:
+                sensor_alert.stop()
+            self._cleared_alerts = []
+            self._alert_timers.cancel_all()
+        elif action == MONITOR_UPDATE_CONFIG:
+            self.load_sensors()
+
+        return True
+
     def check_power(self):
         # load the value once from the adapter
         new_power_source = self._powerAdapter.source_type
@@ -170,73 +253,105 @@ class Monitor(Thread):
 
         self._power_source = new_power_source
 
-    def validate_sensor_config(self):
-        self._logger.debug("Validating config...")
-        channels = set()
-        for sensor in self._sensors:
-            if sensor.channel in channels:
-                self._logger.debug("Channels: %s", channels)
-                return False
-            else:
-                channels.add(sensor.channel)
-
-        self._logger.debug("Channels: %s", channels)
-        return True
-
     def load_sensors(self):
-        """Load the sensors from the db in the thread to avoid session problems"""
+        """Request loading the sensors (the current sensors are scanned until the new ones are loaded)"""
         storage.set(storage.MONITORING_STATE, MONITORING_UPDATING_CONFIG)
         send_system_state_change(MONITORING_UPDATING_CONFIG)
         send_sensors_state(None)
+        self._loader.reload()
 
-        # TODO: wait a little bit to see status for debug
-        sleep(3)
-
-        # !!! delete old sensors before load again
-        self._sensors = []
-        self._sensors = self._db_session.query(Sensor).filter_by(deleted=False).all()
-        self._logger.debug("Sensors reloaded!")
+    def swap_sensor_table(self):
+        """Start scanning with the new sensor table if loaded"""
+        table = self._loader.take_table()
+        if table is None:
+            return
 
-        if len(self._sensors) > self._sensorAdapter.channel_count:
-            self._logger.info(
-                "Invalid number of sensors to monitor (Found=%s > Max=%s)",
-                len(self._sensors),
-                self._sensorAdapter.channel_count,
-            )
-            self._sensors = []
-            storage.set(storage.MONITORING_STATE, MONITORING_INVALID_CONFIG)
-            send_system_state_change(MONITORING_INVALID_CONFIG)
-        elif not self.validate_sensor_config():
-            self._logger.info("Invalid channel configuration")
-            self._sensors = []
+        self._calibration = None
+        self._sensors = table.sensors
+        if not table.valid:
             storage.set(storage.MONITORING_STATE, MONITORING_INVALID_CONFIG)
             send_system_state_change(MONITORING_INVALID_CONFIG)
-        elif self.has_uninitialized_sensor():
+        elif table.calibrate:
             self._logger.info("Found sensor(s) without reference value")
-            self.calibrate_sensors()
-            storage.set(storage.MONITORING_STATE, MONITORING_READY)
-            send_system_state_change(MONITORING_READY)
+            # measured in the next sampling cycles
+            self._logger.info("Initialize sensor references...")
+            self._calibration = Calibration(
+                self._sensorAdapter.channel_count, CALIBRATION_TIME * int(environ["SAMPLE_RATE"])
+            )
         else:
             storage.set(storage.MONITORING_STATE, MONITORING_READY)
             send_system_state_change(MONITORING_READY)
 
+        self.build_sensor_arrays(table)
         send_sensors_state(False)
 
-    def calibrate_sensors(self):
-        self._logger.info("Initialize sensor references...")
-        new_references = self.measure_sensor_references()
-        if len(new_references) == self._sensorAdapter.channel_count:
-            self._logger.info("New references: %s", new_references)
-            self.save_sensor_references(new_references)
-        else:
-            self._logger.error("Error measure values! %s", self._references)
+    def build_sensor_arrays(self, table):
+        """Copy the attributes of the sensors used by the scanning from the sensor table"""
+        # the alert state and the followed references are kept in memory (the database is updated by the persister)
+        alert_states = dict(zip(self._sensor_ids, self._alerting))
+        references = {
+            sensor_id: (reference, self._reference_tracker.calibrated(index))
+            for index, (sensor_id, reference) in enumerate(zip(self._sensor_ids, self._references))
+        }
+
+        self._sensor_ids = table.sensor_ids
+        self._channels = table.channels
+        # sensor without reference is always alerting
+        self._references = array("d", table.references)
+        calibrated_values = array("d", table.calibrated)
+        for index, (sensor_id, reference) in enumerate(zip(table.sensor_ids, table.references)):
+            if not isnan(reference) and sensor_id in references and not isnan(references[sensor_id][0]):
+                self._references[index], calibrated_values[index] = references[sensor_id]
+        self._reference_tracker.reset(self._references, calibrated_values)
+        self._enabled = table.enabled
+        self._alerting = array("b", [alert_states.get(sensor_id, False) for sensor_id in table.sensor_ids])
+        self._filters = table.filters
+
+    def calibrate_sensors(self, values):
+        """Measure the references of all the sensors in the sampling cycles"""
+        if not self._calibration.add(values):
+            return
+
+        new_references = self._calibration.references
+        self._calibration = None
+        self._logger.info("New references: %s", new_references)
+        for index, (sensor_id, channel, old_reference) in enumerate(
+            zip(self._sensor_ids, self._channels, self._references)
+        ):
+            self._references[index] = new_references[channel]
+            self._reference_tracker.set_calibrated(index, new_references[channel])
+            self._persister.set_reference(
+                sensor_id,
+                REASON_CALIBRATION,
+                None if isnan(old_reference) else old_reference,
+                new_references[channel],
+                new_references[channel],
+            )
 
-    def has_uninitialized_sensor(self):
-        for sensor in self._sensors:
-            if sensor.reference_value is None:
-                return True
+        if storage.get(storage.MONITORING_STATE) == MONITORING_UPDATING_CONFIG:
+            storage.set(storage.MONITORING_STATE, MONITORING_READY)
+            send_system_state_change(MONITORING_READY)
 
-        return False
+    def follow_references(self, values):
+        """Follow the drift of the references while disarmed"""
+        if storage.get(storage.ARM_STATE) == ARM_DISARM:
+            self._reference_tracker.update(self._references, values, self._channels, self._alerting)
+
+    def save_references(self):
+        """Save the references changed by following the drift"""
+        for index, old_reference, new_reference in self._reference_tracker.take_changes(
+            self._references, TOLERANCE / 100
+        ):
+            self._logger.debug(
+                "Reference of sensor %s changed: %s -> %s", self._sensor_ids[index], old_reference, new_reference
+            )
+            self._persister.set_reference(
+                self._sensor_ids[index],
+                REASON_ADAPTATION,
+                old_reference,
+                new_reference,
+                self._reference_tracker.calibrated(index),
+            )
 
     def cleanup_database(self):
         changed = False
@@ -254,56 +369,35 @@ class Monitor(Thread):
         if changed:
             self._logger.debug("Cleared db")
             self._db_session.commit()
+            storage.increment(storage.SENSORS_VERSION)
         else:
             self._logger.debug("Cleared nothing")
 
-    def save_sensor_references(self, references):
-        for sensor in self._sensors:
-            sensor.reference_value = references[sensor.channel]
-            self._db_session.commit()
-
-    def measure_sensor_references(self):
-        measurements = []
-        for cycle in range(MEASUREMENT_CYCLES):
-            measurements.append(self._sensorAdapter.get_values())
-            sleep(MEASUREMENT_TIME)
-
-        self._logger.debug("Measured values: %s", measurements)
-
-        references = {}
-        for channel in range(self._sensorAdapter.channel_count):
-            value_sum = 0
-            for cycle in range(MEASUREMENT_CYCLES):
-                value_sum += measurements[cycle][channel]
-            references[channel] = value_sum / MEASUREMENT_CYCLES
-
-        return list(references.values())
-
-    def scan_sensors(self):
-        changes = False
-        found_alert = False
-        for sensor in self._sensors:
-            value = self._sensorAdapter.get_value(sensor.channel)
-            # self._logger.debug("Sensor({}): R:{} -> V:{}".format(sensor.channel, sensor.reference_value, value))
-            if not is_close(value, sensor.reference_value, TOLERANCE):
-                if not sensor.alert:
-                    self._logger.debug(
-                        "Alert on channel: %s, (changed %s -> %s)", sensor.channel, sensor.reference_value, value
-                    )
-                    sensor.alert = True
-                    changes = True
+    def scan_sensors(self, values):
+        # filter the values of all the sensors and collect the changed ones
+        alerting = [
+            sensor_filter.process(values[channel], reference, alert)
+            for sensor_filter, channel, reference, alert in zip(
+                self._filters, self._channels, self._references, self._alerting
+            )
+        ]
+        changed = [index for index, (new, old) in enumerate(zip(alerting, self._alerting)) if new != old]
+        if not changed:
+            return
+
+        for index in changed:
+            channel = self._channels[index]
+            if alerting[index]:
+                self._logger.debug(
+                    "Alert on channel: %s, (changed %s -> %s)", channel, self._references[index], values[channel]
+                )
             else:
-                if sensor.alert:
-                    self._logger.debug("Cleared alert on channel: %s", sensor.channel)
-                    sensor.alert = False
-                    changes = True
+                self._logger.debug("Cleared alert on channel: %s", channel)
 
-            if sensor.alert and sensor.enabled:
-                found_alert = True
+            self._alerting[index] = alerting[index]
+            self._persister.set_alert(self._sensor_ids[index], alerting[index])
 
-        if changes:
-            self._db_session.commit()
-            send_sensors_state(found_alert)
+        send_sensors_state(any(alert and enabled for alert, enabled in zip(self._alerting, self._enabled)))
 
     def handle_alerts(self):
         """
@@ -313,35 +407,33 @@ class Monitor(Thread):
         # save current state to avoid concurrency
         current_arm = storage.get(storage.ARM_STATE)
 
-        changes = False
-        for sensor in self._sensors:
-            if sensor.alert and sensor.id not in self._alerts and sensor.enabled:
+        for sensor, alert in zip(self._sensors, self._alerting):
+            if alert and sensor.id not in self._alerts and sensor.enabled:
                 alert_type = None
                 # sabotage has higher priority
-                if sensor.zone.disarmed_delay is not None:
+                if sensor.disarmed_delay is not None:
                     alert_type = ALERT_SABOTAGE
-                    delay = sensor.zone.disarmed_delay
-                elif current_arm == ARM_AWAY and sensor.zone.away_delay is not None:
+                    delay = sensor.disarmed_delay
+                elif current_arm == ARM_AWAY and sensor.away_delay is not None:
                     alert_type = ALERT_AWAY
-                    delay = sensor.zone.away_delay
-                elif current_arm == ARM_STAY and sensor.zone.stay_delay is not None:
+                    delay = sensor.away_delay
+                elif current_arm == ARM_STAY and sensor.stay_delay is not None:
                     alert_type = ALERT_STAY
-                    delay = sensor.zone.stay_delay
+                    delay = sensor.stay_delay
 
                 if alert_type:
-                    self._alerts[sensor.id] = {
-                        "alert": monitoring.alert.SensorAlert(sensor.id, delay, alert_type, self._stop_alert)
-                    }
-                    self._alerts[sensor.id]["alert"].start()
-                    changes = True
+                    self._alerts[sensor.id] = monitoring.alert.SensorAlert(
+                        sensor.id, delay, alert_type, self._stop_alert
+                    )
+                    self._alerts[sensor.id].start(self._alert_timers)
                     self._stop_alert.clear()
-            elif not sensor.alert and sensor.id in self._alerts:
-                if self._alerts[sensor.id]["alert"]._alert_type == ALERT_SABOTAGE:
+            elif not alert and sensor.id in self._alerts:
+                if self._alerts[sensor.id].alert_type == ALERT_SABOTAGE:
                     # stop sabotage
                     storage.set(storage.MONITORING_STATE, MONITORING_READY)
                     send_system_state_change(MONITORING_READY)
-                del self._alerts[sensor.id]
+                # the delay continues (ex. door opened and closed), keep it for disarm
+                self._cleared_alerts.append(self._alerts.pop(sensor.id))
 
-        if changes:
-            self._logger.debug("Save sensor changes")
-            self._db_session.commit()
+        if self._cleared_alerts:
+            self._cleared_alerts = [sensor_alert for sensor_alert in self._cleared_alerts if sensor_alert.waiting]
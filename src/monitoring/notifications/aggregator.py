@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import os
+from datetime import datetime
+from time import monotonic
+
+from dateutil.tz import tzlocal
+
+from monitoring.notifications.messages import ALERT_DIGEST, ALERT_STARTED, ALERT_STOPPED
+
+# seconds of merging the notifications after a notification was sent (0: disabled)
+NOTIFICATION_WINDOW = float(os.environ.get("NOTIFICATION_WINDOW", 60))
+
+
+class NotificationAggregator(object):
+    """
+    Merge the alert notifications into digests.
+
+    The first notification is sent immediately and opens the window. The notifications
+    during the window are merged and sent as one digest at the end of the window
+    (which opens a new window). The window is closed when nothing was merged.
+    The start of an alert is merged only if an other alert started in the window.
+    """
+
+    def __init__(self, window=NOTIFICATION_WINDOW):
+        self._window = window
+        self._window_end = None
+        self._started = False
+        # alert id => merged changes of the alert
+        self._alerts = {}
+
+    def add(self, message):
+        """Return the message if it has to be sent immediately or merge it into the digest"""
+        now = monotonic()
+        if self._window_end is None or (now >= self._window_end and not self._alerts):
+            if self._window:
+                self._window_end = now + self._window
+            self._started = message["type"] == ALERT_STARTED
+            return message
+
+        if message["type"] == ALERT_STARTED and not self._started:
+            self._started = True
+            return message
+
+        alert = self._alerts.setdefault(
+            message["id"], {"id": message["id"], "sensors": [], "started": None, "stopped": None}
+        )
+        for sensor in message.get("sensors", []):
+            if sensor not in alert["sensors"]:
+                alert["sensors"].append(sensor)
+        if message["type"] == ALERT_STARTED:
+            alert["started"] = str(message["time"])
+            self._started = True
+        elif message["type"] == ALERT_STOPPED:
+            alert["stopped"] = str(message["time"])
+        alert.setdefault("events", []).append(message)
+
+        return None
+
+    def timeout(self):
+        """Return the seconds until the end of the window (None: no window)"""
+        if self._window_end is None:
+            return None
+
+        return max(self._window_end - monotonic(), 0)
+
+    def flush(self, force=False):
+        """Return the digest at the end of the window (or the forced end)"""
+        now = monotonic()
+        if self._window_end is None or (now < self._window_end and not force):
+            return None
+
+        if not self._alerts:
+            self._window_end = None
+            return None
+
+        alerts = list(self._alerts.values())
+        self._alerts = {}
+        self._window_end = now + self._window
+
+        events = [event for alert in alerts for event in alert.pop("events")]
+        self._started = any(event["type"] == ALERT_STARTED for event in events)
+        if len(events) == 1:
+            # nothing to merge
+            return events[0]
+
+        return {
+            "type": ALERT_DIGEST,
+            "events": sorted({event["type"] for event in events}),
+            "alerts": alerts,
+            "time": datetime.now(tzlocal()),
+        }
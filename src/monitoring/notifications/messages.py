@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+
+"""
+Messages
+
+{
+    "type": "alert_started" / "alert_sensors" / "alert_stopped",
+    "id": "alert id",
+    "sensors": ["Sensor name"],
+    "time": "start time / time of the new sensors / end time",
+}
+
+Digest of the merged messages
+
+{
+    "type": "alert_digest",
+    "events": ["alert_started", "alert_sensors", "alert_stopped"],
+    "alerts": [
+        {
+            "id": "alert id",
+            "sensors": ["Sensor name"],
+            "started": "start time" / None,
+            "stopped": "end time" / None,
+        }
+    ],
+    "time": "time of the digest",
+}
+"""
+
+ALERT_STARTED = "alert_started"
+ALERT_SENSORS = "alert_sensors"
+ALERT_STOPPED = "alert_stopped"
+ALERT_DIGEST = "alert_digest"
+
+# the subscription of the message types
+SUBSCRIPTIONS = {
+    ALERT_STARTED: ALERT_STARTED,
+    ALERT_SENSORS: ALERT_STARTED,
+    ALERT_STOPPED: ALERT_STOPPED,
+}
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+from concurrent.futures import Future, TimeoutError
+from queue import Empty, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+
+from monitoring.constants import LOG_ADGSM, THREAD_GSM
+
+# check if running on Raspberry
+if os.uname()[4][:3] == "arm":
+    from monitoring.adapters.gsm import GSM
+else:
+    from monitoring.adapters.mock.gsm import GSM
+
+
+class GSMManager(Thread):
+    """
+    Keep the connection to the GSM modem and send the queued SMS.
+
+    The modem is connected once and reconnected only if the settings (port, baud, PIN) change
+    or the connection is lost. The signal strength is checked in the background, so sending
+    doesn't wait for the network coverage.
+    """
+
+    # seconds between the connection attempts
+    RETRY_GAP = 5
+    # seconds between checking the signal strength
+    SIGNAL_PERIOD = 30
+    # seconds of waiting for sending an SMS
+    SEND_TIMEOUT = 60
+    # failed signal checks (not the missing network) and sendings in a row before reconnecting
+    MAX_FAILURES = 3
+
+    def __init__(self, gsm=None):
+        super(GSMManager, self).__init__(name=THREAD_GSM, daemon=True)
+        self._logger = logging.getLogger(LOG_ADGSM)
+        self._gsm = gsm or GSM()
+        self._lock = Lock()
+        self._settings = None
+        self._connected_settings = None
+        # the connection failed with the settings (ex. wrong PIN), wait for new settings
+        self._failed_settings = None
+        self._settings_logged = ()
+        self._messages = Queue()
+        self._stop_event = Event()
+        self._failures = 0
+        self.signal_strength = -1
+
+    def configure(self, port, baud, pin_code):
+        """Set the connection settings (reconnect only if changed)"""
+        with self._lock:
+            self._settings = (port, str(baud), pin_code) if pin_code else None
+        # wake up
+        self._messages.put(None)
+
+    def stop(self):
+        self._stop_event.set()
+        self._messages.put(None)
+
+    def send_sms(self, phone_numbers, message, timeout=SEND_TIMEOUT):
+        """Send the message to the phone numbers and return the result by phone number"""
+        futures = {}
+        for phone_number in phone_numbers:
+            future = Future()
+            futures[phone_number] = future
+            self._messages.put((phone_number, message, future))
+
+        results = {}
+        deadline = monotonic() + timeout
+        for phone_number, future in futures.items():
+            try:
+                results[phone_number] = future.result(max(deadline - monotonic(), 0))
+            except TimeoutError:
+                # don't send later (it's retried by the caller)
+                future.cancel()
+                results[phone_number] = False
+
+        return results
+
+    def run(self):
+        self._logger.info("GSM manager started")
+        last_connect = last_signal_check = -GSMManager.SIGNAL_PERIOD
+        while not self._stop_event.is_set():
+            item = None
+            try:
+                if monotonic() - last_connect > GSMManager.RETRY_GAP and self.update_connection():
+                    last_connect = monotonic()
+
+                if self._gsm.connected and monotonic() - last_signal_check > GSMManager.SIGNAL_PERIOD:
+                    self.check_signal()
+                    last_signal_check = monotonic()
+
+                try:
+                    item = self._messages.get(timeout=GSMManager.RETRY_GAP)
+                except Empty:
+                    continue
+
+                if item is not None:
+                    self.send_item(*item)
+            except Exception:
+                # ex. serial error when the modem is unplugged
+                self._logger.exception("GSM modem failed, reconnecting...")
+                self.reconnect()
+                last_connect = monotonic()
+                if item is not None and not item[2].done():
+                    item[2].set_result(False)
+
+        self._gsm.close()
+        self._logger.info("GSM manager stopped")
+
+    def update_connection(self):
+        """(Re)connect if the settings changed or not connected, return True if tried to connect"""
+        with self._lock:
+            settings = self._settings
+
+        if settings == self._connected_settings and self._gsm.connected:
+            return False
+
+        if self._gsm.connected:
+            self._logger.info("GSM settings changed, reconnecting...")
+        self.reconnect()
+
+        if settings is None:
+            if self._settings_logged is not None:
+                self._logger.info("Pin code not defined, skip connecting to GSM modem")
+            self._settings_logged = None
+            return False
+        self._settings_logged = settings
+        if settings == self._failed_settings:
+            return False
+
+        result = self._gsm.connect(*settings)
+        if result == GSM.CONNECTED:
+            self._connected_settings = settings
+            self._failed_settings = None
+        elif result == GSM.FAILED:
+            self._logger.error("Can't connect to GSM modem, waiting for new settings")
+            self._failed_settings = settings
+
+        return True
+
+    def reconnect(self):
+        """Close the modem, it's connected again by the next iteration"""
+        self._gsm.close()
+        self._connected_settings = None
+        self._failures = 0
+        self.signal_strength = -1
+
+    def register_failure(self, failed):
+        """Reconnect after too many failures in a row (ex. the modem was reset)"""
+        self._failures = self._failures + 1 if failed else 0
+        if self._failures >= GSMManager.MAX_FAILURES:
+            self._logger.warning("GSM modem not responding, reconnecting...")
+            self.reconnect()
+
+    def check_signal(self):
+        signal_strength = self._gsm.get_signal_strength()
+        # without network coverage the modem still answers
+        self.register_failure(signal_strength is None)
+        if signal_strength is None:
+            signal_strength = -1
+        if (signal_strength > 0) != (self.signal_strength > 0):
+            if signal_strength > 0:
+                self._logger.info("GSM network available (signal strength: %s)", signal_strength)
+            else:
+                self._logger.warning("No GSM network coverage!")
+        if self._gsm.connected:
+            self.signal_strength = signal_strength
+
+    def send_item(self, phone_number, message, future):
+        if not future.set_running_or_notify_cancel():
+            return
+
+        if not self._gsm.connected:
+            self._logger.info("GSM modem not connected, can't send message to %s", phone_number)
+            future.set_result(False)
+            return
+
+        if self.signal_strength <= 0:
+            # check again before failing
+            self.check_signal()
+            if self.signal_strength <= 0:
+                future.set_result(False)
+                return
+
+        result = self._gsm.sendSMS(phone_number, message)
+        future.set_result(result)
+        self.register_failure(not result)
@@ -7,44 +7,42 @@
 import json
 import logging
 import os
-import smtplib
+from datetime import datetime
 from queue import Empty
-from smtplib import SMTPException
-from threading import Thread
+from threading import Lock, Thread
 from time import sleep
 
-from models import Option
+from dateutil.tz import tzlocal
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Notification, Option
 from monitoring.constants import LOG_NOTIFIER, MONITOR_STOP, MONITOR_UPDATE_CONFIG, THREAD_NOTIFIER
 from monitoring.database import Session
+from monitoring.notifications.aggregator import NotificationAggregator
+from monitoring.notifications.messages import (
+    ALERT_DIGEST,
+    ALERT_SENSORS,
+    ALERT_STARTED,
+    ALERT_STOPPED,
+    SUBSCRIPTIONS,
+)
+from monitoring.notifications.modem import GSMManager
+from monitoring.notifications.outbox import DeliveryWorker
+from monitoring.notifications.smtp import SMTPSession
 from monitoring.notifications.templates import (
+    ALERT_DIGEST_EMAIL,
+    ALERT_DIGEST_EMAIL_ITEM,
+    ALERT_DIGEST_SMS,
+    ALERT_SENSORS_EMAIL,
+    ALERT_SENSORS_SMS,
     ALERT_STARTED_EMAIL,
     ALERT_STARTED_SMS,
     ALERT_STOPPED_EMAIL,
     ALERT_STOPPED_SMS,
 )
 
-# check if running on Raspberry
-if os.uname()[4][:3] == "arm":
-    from monitoring.adapters.gsm import GSM
-else:
-    from monitoring.adapters.mock.gsm import GSM
-
-
-"""
-Messages
-
-{
-    "type": "alert_started" / "alert_stopped",
-    "id": "alert id",
-    "sensors": ["Sensor name"],
-    "time": "start time",
-}
-
-
-"""
-
-ALERT_STARTED = "alert_started"
-ALERT_STOPPED = "alert_stopped"
+CHANNEL_SMS = "sms"
+CHANNEL_EMAIL = "email"
 
 """
 options = {
@@ -61,20 +59,27 @@ options = {
         }
     },
     "email": {
+        'smtp_host': 'smtp.gmail.com', (optional)
+        'smtp_port': 587, (optional)
+        'smtp_starttls': True, (optional)
         'smtp_username': 'smtp_username',
         'smtp_password': 'smtp_password',
         'email_address': 'email_address'
     },
     "gsm": {
-        "phone_number": "phone number"
+        "pin_code": "PIN code",
+        "phone_number": "phone number(s) separated by , or ;"
     }
 }
 """
 
 
 class Notifier(Thread):
-    MAX_RETRY = 5
-    RETRY_WAIT = 30
+    """
+    Save the messages to the outbox for every subscribed channel.
+    The messages are delivered by the delivery workers of the channels.
+    The messages of an alert storm are merged into digests by the aggregator.
+    """
 
     _actions = None
 
@@ -89,6 +94,17 @@ class Notifier(Thread):
             }
         )
 
+    @classmethod
+    def notify_alert_sensors(cls, alert_id, sensors, time):
+        cls._actions.put(
+            {
+                "type": ALERT_SENSORS,
+                "id": alert_id,
+                "sensors": sensors,
+                "time": time,
+            }
+        )
+
     @classmethod
     def notify_alert_stopped(cls, alert_id, time):
         cls._actions.put({"type": ALERT_STOPPED, "id": alert_id, "time": time})
@@ -97,10 +113,16 @@ class Notifier(Thread):
         super(Notifier, self).__init__(name=THREAD_NOTIFIER)
         Notifier._actions = notifications_queue
         self._logger = logging.getLogger(LOG_NOTIFIER)
-        self._gsm = GSM()
-        self._messages = []
+        self._gsm = GSMManager()
+        self._smtp = None
+        self._smtp_lock = Lock()
         self._options = None
         self._db_session = None
+        self._aggregator = NotificationAggregator()
+        self._workers = [
+            DeliveryWorker(CHANNEL_SMS, self.send_SMS),
+            DeliveryWorker(CHANNEL_EMAIL, self.send_email, idle=self.close_idle_email),
+        ]
 
     def run(self):
         self._logger.info("Notifier started...")
@@ -113,40 +135,48 @@ class Notifier(Thread):
         self._options = self.get_options()
         self._logger.info("Subscription configuration: %s", self._options["subscriptions"])
 
-        self._gsm.setup()
+        # deliver the pending notifications (ex. from before restart)
+        for worker in self._workers:
+            worker.start()
+
+        self._gsm.start()
+        self.configure_gsm()
+
         while True:
-            message = None
             try:
-                message = self._actions.get(timeout=Notifier.RETRY_WAIT)
+                # wake up at the end of the aggregation window
+                message = self._actions.get(timeout=self._aggregator.timeout())
             except Empty:
-                # self._logger.debug("No message found")
-                pass
+                message = None
 
             # handle actions or messages
             if type(message) is str:
                 if message == MONITOR_STOP:
+                    # the digest is delivered from the outbox after restart
+                    self.save_message(self._aggregator.flush(force=True))
                     break
                 elif message == MONITOR_UPDATE_CONFIG:
                     self._options = self.get_options()
-                    self._gsm.destroy()
-                    self._gsm = GSM()
-                    self._gsm.setup()
+                    with self._smtp_lock:
+                        if self._smtp:
+                            self._smtp.close()
+                        self._smtp = None
+                    # reconnects only if the connection settings changed
+                    self.configure_gsm()
             elif message is not None:
-                message["retry"] = 0
-                self._messages.append(message)
-
-            # try to send the message but not forever
-            if len(self._messages) > 0:
-                message = self._messages[0]
-                if self.send_message(message):
-                    self._messages.pop(0)
-                else:
-                    message["retry"] += 1
-                    if message["retry"] >= Notifier.MAX_RETRY:
-                        self._logger.debug(
-                            "Deleted message after max retry (%s): %s", Notifier.MAX_RETRY, self._messages.pop(0)
-                        )
-
+                self.save_message(self._aggregator.add(message))
+
+            self.save_message(self._aggregator.flush())
+
+        for worker in self._workers:
+            worker.stop()
+        for worker in self._workers:
+            worker.join()
+        self._gsm.stop()
+        self._gsm.join()
+        with self._smtp_lock:
+            if self._smtp:
+                self._smtp.close()
         self._db_session.close()
         self._logger.info("Notifier stopped")
 
@@ -158,62 +188,157 @@ class Notifier(Thread):
         self._logger.debug("Notifier loaded subscriptions: {}".format(options))
         return options
 
-    def send_message(self, message):
-        self._logger.info("Sending message: %s", message)
-        success = False
-        has_subscription = False
+    def configure_gsm(self):
+        pin_code = self._options["gsm"].get("pin_code") if self._options["gsm"] else None
+        self._gsm.configure(os.environ["GSM_PORT"], os.environ["GSM_PORT_BAUD"], pin_code)
+
+    def get_phone_numbers(self):
+        try:
+            phone_numbers = self._options["gsm"]["phone_number"]
+        except (KeyError, TypeError):
+            return []
+
+        return [number.strip() for number in phone_numbers.replace(";", ",").split(",") if number.strip()]
+
+    def is_subscribed(self, channel, message):
+        # the digest is sent if any of the merged messages is subscribed
+        message_types = message["events"] if message["type"] == ALERT_DIGEST else [message["type"]]
         try:
-            if self._options["subscriptions"]["sms"][message["type"]]:
-                if message["type"] == ALERT_STARTED:
-                    has_subscription = True
-                    success |= self.notify_alert_started_SMS(message)
-                elif message["type"] == ALERT_STOPPED:
-                    has_subscription = True
-                    success |= self.notify_alert_stopped_SMS(message)
-
-            if self._options["subscriptions"]["email"][message["type"]]:
-                if message["type"] == ALERT_STARTED:
-                    has_subscription = True
-                    success |= self.notify_alert_started_email(message)
-                elif message["type"] == ALERT_STOPPED:
-                    has_subscription = True
-                    success |= self.notify_alert_stopped_email(message)
-        except (KeyError, TypeError) as error:
-            self._logger.info("Failed to send message: '%s'! (%s)", message, error)
-        except Exception:
-            self._logger.exception("Sending message failed!")
-
-        return not (not success and has_subscription)
+            subscriptions = self._options["subscriptions"][channel]
+            return any(subscriptions.get(SUBSCRIPTIONS[message_type]) for message_type in message_types)
+        except (KeyError, TypeError, AttributeError):
+            return False
+
+    def save_message(self, message):
+        """Save the message to the outbox of the subscribed channels and wake up their workers"""
+        if message is None:
+            return
+
+        self._logger.info("Saving message: %s", message)
+        # the time is sent as text
+        message = {**message, "time": str(message["time"])}
+        workers = [worker for worker in self._workers if self.is_subscribed(worker.channel, message)]
+        if not workers:
+            self._logger.debug("No subscription for message: %s", message)
+            return
+
+        now = datetime.now(tzlocal())
+        notifications = []
+        for worker in workers:
+            if worker.channel == CHANNEL_SMS:
+                if not self.get_phone_numbers():
+                    self._logger.warning("No phone number for SMS notification: %s", message)
+                    continue
+
+                # one notification by recipient to retry only the failed ones
+                notifications.extend(
+                    Notification(worker.channel, {**message, "recipient": phone_number}, now)
+                    for phone_number in self.get_phone_numbers()
+                )
+            else:
+                notifications.append(Notification(worker.channel, message, now))
+
+        try:
+            self._db_session.add_all(notifications)
+            self._db_session.commit()
+        except SQLAlchemyError:
+            self._logger.exception("Failed to save message: %s", message)
+            self._db_session.rollback()
+            return
+
+        for worker in workers:
+            worker.wake_up()
+
+    def send_SMS(self, message):
+        if message["type"] == ALERT_STARTED:
+            return self.notify_alert_started_SMS(message)
+        elif message["type"] == ALERT_SENSORS:
+            return self.notify_alert_sensors_SMS(message)
+        elif message["type"] == ALERT_STOPPED:
+            return self.notify_alert_stopped_SMS(message)
+        elif message["type"] == ALERT_DIGEST:
+            return self.notify_alert_digest_SMS(message)
+
+        self._logger.info("Unknown message: %s", message)
+        return True
+
+    def send_email(self, message):
+        if message["type"] == ALERT_STARTED:
+            return self.notify_alert_started_email(message)
+        elif message["type"] == ALERT_SENSORS:
+            return self.notify_alert_sensors_email(message)
+        elif message["type"] == ALERT_STOPPED:
+            return self.notify_alert_stopped_email(message)
+        elif message["type"] == ALERT_DIGEST:
+            return self.notify_alert_digest_email(message)
+
+        self._logger.info("Unknown message: %s", message)
+        return True
 
     def notify_alert_started_SMS(self, message):
-        return self.notify_SMS(ALERT_STARTED_SMS.format(**message))
+        return self.notify_SMS(message.get("recipient"), ALERT_STARTED_SMS.format(**message))
+
+    def notify_alert_sensors_SMS(self, message):
+        return self.notify_SMS(message.get("recipient"), ALERT_SENSORS_SMS.format(**message))
 
     def notify_alert_stopped_SMS(self, message):
-        return self.notify_SMS(ALERT_STOPPED_SMS.format(**message))
+        return self.notify_SMS(message.get("recipient"), ALERT_STOPPED_SMS.format(**message))
+
+    def notify_alert_digest_SMS(self, message):
+        started = [str(alert["id"]) for alert in message["alerts"] if alert["started"]]
+        stopped = [str(alert["id"]) for alert in message["alerts"] if alert["stopped"]]
+        return self.notify_SMS(
+            message.get("recipient"),
+            ALERT_DIGEST_SMS.format(
+                time=message["time"], started=", ".join(started) or "-", stopped=", ".join(stopped) or "-"
+            ),
+        )
 
     def notify_alert_started_email(self, message):
         return self.notify_email("Alert started", ALERT_STARTED_EMAIL.format(**message))
 
+    def notify_alert_sensors_email(self, message):
+        return self.notify_email("Alert continued", ALERT_SENSORS_EMAIL.format(**message))
+
     def notify_alert_stopped_email(self, message):
         return self.notify_email("Alert stopped", ALERT_STOPPED_EMAIL.format(**message))
 
-    def notify_SMS(self, message):
-        return self._gsm.sendSMS(self._options["gsm"]["phone_number"], message)
+    def notify_alert_digest_email(self, message):
+        alerts = "\n".join(
+            ALERT_DIGEST_EMAIL_ITEM.format(
+                id=alert["id"],
+                started=alert["started"] or "-",
+                stopped=alert["stopped"] or "-",
+                sensors=", ".join(alert["sensors"]) or "-",
+            )
+            for alert in message["alerts"]
+        )
+        return self.notify_email("Alert summary", ALERT_DIGEST_EMAIL.format(time=message["time"], alerts=alerts))
+
+    def notify_SMS(self, phone_number, message):
+        # messages saved before the fan-out by recipient
+        phone_numbers = [phone_number] if phone_number else self.get_phone_numbers()
+        if not phone_numbers:
+            self._logger.warning("No phone number, can't send SMS")
+            return False
+
+        return all(self._gsm.send_sms(phone_numbers, message).values())
 
     def notify_email(self, subject, content):
         self._logger.info("Sending email ...")
-        try:
-            server = smtplib.SMTP("smtp.gmail.com:587")
-            server.ehlo()
-            server.starttls()
-            server.login(self._options["email"]["smtp_username"], self._options["email"]["smtp_password"])
-
-            message = "Subject: {}\n\n{}".format(subject, content).encode(encoding="utf_8", errors="strict")
-            server.sendmail(from_addr="info@argus", to_addrs=self._options["email"]["email_address"], msg=message)
-            server.quit()
-        except SMTPException as error:
-            self._logger.error("Can't send email %s ", error)
-            return False
+        message = "Subject: {}\n\n{}".format(subject, content).encode(encoding="utf_8", errors="strict")
+        with self._smtp_lock:
+            # the connection is reused by the next emails
+            if self._smtp is None:
+                self._smtp = SMTPSession.from_options(self._options["email"])
+
+            if not self._smtp.send("info@argus", self._options["email"]["email_address"], message):
+                return False
 
         self._logger.info("Sent email")
         return True
+
+    def close_idle_email(self):
+        with self._smtp_lock:
+            if self._smtp:
+                self._smtp.close_idle()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+from datetime import datetime, timedelta
+from threading import Event, Thread
+
+from dateutil.tz import tzlocal
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Notification
+from monitoring.constants import LOG_NOTIFIER, THREAD_NOTIFIER
+from monitoring.database import Session
+
+
+class DeliveryWorker(Thread):
+    """
+    Deliver the pending notifications of one channel from the outbox (notification table).
+
+    The failed notifications are retried with exponential backoff without blocking
+    the newer notifications and the other channels.
+    """
+
+    # seconds before the first retry (doubled by every failure)
+    RETRY_WAIT = 10
+    MAX_RETRY_WAIT = 600
+    MAX_RETRY = 10
+    # seconds between checking the outbox without wake up
+    POLL_PERIOD = 60
+    # seconds after the notification is dropped (ex. pending before a long shutdown)
+    EXPIRY = 24 * 3600
+
+    def __init__(self, channel, send, idle=None):
+        """
+        channel: name of the channel (sms / email)
+        send: function(message) returns True if the message was sent
+        idle: function called after sending the due notifications (ex. closing connections)
+        """
+        super(DeliveryWorker, self).__init__(name=f"{THREAD_NOTIFIER}.{channel}", daemon=True)
+        self._logger = logging.getLogger(LOG_NOTIFIER)
+        self._channel = channel
+        self._send = send
+        self._idle = idle
+        self._wake_up = Event()
+        self._stop_event = Event()
+        self._db_session = None
+
+    @property
+    def channel(self):
+        return self._channel
+
+    def wake_up(self):
+        """Check the outbox for new notifications"""
+        self._wake_up.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_up.set()
+
+    def run(self):
+        self._logger.info("Delivery of %s notifications started", self._channel)
+        self._db_session = Session()
+        while not self._stop_event.is_set():
+            wait = self.deliver_pending()
+            if self._idle and wait:
+                self._idle()
+            self._wake_up.wait(wait)
+            self._wake_up.clear()
+
+        Session.remove()
+        self._logger.info("Delivery of %s notifications stopped", self._channel)
+
+    def deliver_pending(self):
+        """Send the due notifications and return the seconds until the next attempt"""
+        attempted = False
+        try:
+            notifications = (
+                self._db_session.query(Notification)
+                .filter_by(channel=self._channel, state=Notification.STATE_PENDING)
+                .order_by(Notification.next_attempt, Notification.id)
+                .all()
+            )
+            for notification in notifications:
+                if self._stop_event.is_set():
+                    break
+
+                now = datetime.now(tzlocal())
+                if notification.next_attempt > now:
+                    return min((notification.next_attempt - now).total_seconds(), DeliveryWorker.POLL_PERIOD)
+
+                self.deliver(notification, now)
+                self._db_session.commit()
+                attempted = True
+        except SQLAlchemyError:
+            self._logger.exception("Failed to access the %s notifications", self._channel)
+            self._db_session.rollback()
+            return DeliveryWorker.RETRY_WAIT
+
+        # check the rescheduled notifications
+        return 0 if attempted else DeliveryWorker.POLL_PERIOD
+
+    def deliver(self, notification, now):
+        if (now - notification.created).total_seconds() > DeliveryWorker.EXPIRY:
+            self._logger.info("Dropped expired notification: %s", notification.id)
+            notification.state = Notification.STATE_FAILED
+            notification.last_error = "Expired"
+            return
+
+        try:
+            sent = self._send(json.loads(notification.message))
+            error = None if sent else "Sending failed"
+        except Exception as exception:
+            self._logger.exception("Sending %s notification failed!", self._channel)
+            sent = False
+            error = str(exception)
+
+        notification.attempts += 1
+        if sent:
+            notification.state = Notification.STATE_SENT
+            notification.sent = now
+            notification.last_error = None
+        elif notification.attempts >= DeliveryWorker.MAX_RETRY:
+            self._logger.info(
+                "Dropped notification after max retry (%s): %s", DeliveryWorker.MAX_RETRY, notification.id
+            )
+            notification.state = Notification.STATE_FAILED
+            notification.last_error = error
+        else:
+            wait = min(DeliveryWorker.RETRY_WAIT * 2 ** (notification.attempts - 1), DeliveryWorker.MAX_RETRY_WAIT)
+            self._logger.debug("Retry %s notification %s in %s seconds", self._channel, notification.id, wait)
+            notification.next_attempt = now + timedelta(seconds=wait)
+            notification.last_error = error
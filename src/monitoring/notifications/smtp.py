@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import smtplib
+from smtplib import SMTPException
+from time import monotonic
+
+from monitoring.constants import LOG_NOTIFIER
+
+DEFAULT_HOST = "smtp.gmail.com"
+DEFAULT_PORT = 587
+# seconds of waiting for the server
+TIMEOUT = 30
+
+
+class SMTPSession(object):
+    """
+    Reusable connection to the SMTP server.
+
+    The connection is opened (EHLO, STARTTLS, login) by the first message, checked with NOOP
+    before sending after a pause and closed after the idle timeout.
+    """
+
+    # seconds without sending before checking the connection
+    KEEPALIVE = 10
+    # seconds without sending before closing the connection
+    IDLE_TIMEOUT = 30
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, username=None, password=None, starttls=True):
+        self._logger = logging.getLogger(LOG_NOTIFIER)
+        self._host = host
+        self._port = port
+        self._username = username
+        self._password = password
+        self._starttls = starttls
+        self._server = None
+        self._last_used = 0
+
+    @classmethod
+    def from_options(cls, options):
+        """Create the session from the email options"""
+        return cls(
+            host=options.get("smtp_host") or DEFAULT_HOST,
+            port=int(options.get("smtp_port") or DEFAULT_PORT),
+            username=options.get("smtp_username"),
+            password=options.get("smtp_password"),
+            starttls=options.get("smtp_starttls", True),
+        )
+
+    def send(self, from_address, to_address, message):
+        """Send the message, reconnect once if the connection was lost"""
+        for attempt in range(2):
+            try:
+                self.connect()
+                self._server.sendmail(from_addr=from_address, to_addrs=to_address, msg=message)
+                self._last_used = monotonic()
+                return True
+            except smtplib.SMTPServerDisconnected as error:
+                self._logger.info("SMTP connection lost: %s", error)
+                self._server = None
+            except (SMTPException, OSError) as error:
+                self._logger.error("Can't send email %s ", error)
+                self.close()
+                return False
+
+        return False
+
+    def connect(self):
+        if self._server is not None and monotonic() - self._last_used > SMTPSession.KEEPALIVE:
+            try:
+                if self._server.noop()[0] != 250:
+                    self.close()
+            except (SMTPException, OSError):
+                self._server = None
+
+        if self._server is None:
+            self._logger.debug("Connecting to SMTP server %s:%s", self._host, self._port)
+            server = smtplib.SMTP(self._host, self._port, timeout=TIMEOUT)
+            try:
+                server.ehlo()
+                if self._starttls:
+                    server.starttls()
+                    server.ehlo()
+                if self._username:
+                    server.login(self._username, self._password)
+            except (SMTPException, OSError):
+                server.close()
+                raise
+
+            self._server = server
+            self._last_used = monotonic()
+
+    def close_idle(self):
+        """Close the connection after the idle timeout"""
+        if self._server is not None and monotonic() - self._last_used > SMTPSession.IDLE_TIMEOUT:
+            self._logger.debug("Closing idle SMTP connection")
+            self.close()
+
+    def close(self):
+        if self._server is None:
+            return
+
+        try:
+            self._server.quit()
+        except (SMTPException, OSError):
+            self._server.close()
+        self._server = None
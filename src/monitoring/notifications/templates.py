@@ -24,3 +24,26 @@ The alert({id}) stopped at {time}!
 ArPI Home Security
 
 """
+
+ALERT_SENSORS_SMS = "Alert({id}) continued on more sensors at {time}!"
+ALERT_SENSORS_EMAIL = """
+Hi,
+
+The alert({id}) continued at {time}.
+The alert continued on sensor(s): {sensors}!
+
+ArPI Home Security
+
+"""
+
+ALERT_DIGEST_SMS = "Alerts until {time}! Started: {started} Stopped: {stopped}"
+ALERT_DIGEST_EMAIL = """
+Hi,
+
+Summary of the alerts until {time}:
+{alerts}
+
+ArPI Home Security
+
+"""
+ALERT_DIGEST_EMAIL_ITEM = "  - alert({id}) started: {started}, stopped: {stopped}, sensor(s): {sensors}"
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import logging
+from datetime import datetime
+from threading import Event, Lock, Thread
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from dateutil.tz import tzlocal
+
+from models import Sensor, SensorReference
+from monitoring import storage
+from monitoring.constants import LOG_PERSISTER, THREAD_PERSISTER
+from monitoring.database import Session
+
+
+class AlertPersister(Thread):
+    """
+    Write-behind saving of the alert state and the reference value of the sensors.
+
+    The changes are collected in memory (only the last state of a sensor is kept)
+    and saved periodically in one transaction, so the sensor scanning never waits for the database.
+    The changes of the reference values are also saved in the audit trail (SensorReference).
+    """
+
+    # seconds between two flushes
+    FLUSH_PERIOD = 1
+
+    def __init__(self):
+        super(AlertPersister, self).__init__(name=THREAD_PERSISTER, daemon=True)
+        self._logger = logging.getLogger(LOG_PERSISTER)
+        self._lock = Lock()
+        self._pending = {}
+        self._references = {}
+        self._stop_event = Event()
+        self._db_session = None
+
+    def set_alert(self, sensor_id, alert):
+        """Register the new alert state of the sensor"""
+        with self._lock:
+            self._pending[sensor_id] = bool(alert)
+
+    def set_reference(self, sensor_id, reason, old_value, new_value, calibrated_value):
+        """Register the new reference value of the sensor"""
+        with self._lock:
+            if sensor_id in self._references:
+                # keep the value before the first unsaved change
+                old_value = self._references[sensor_id].old_value
+
+            self._references[sensor_id] = SensorReference(
+                sensor_id, datetime.now(tzlocal()), reason, old_value, new_value, calibrated_value
+            )
+
+    def stop(self):
+        """Save the pending changes and stop the thread"""
+        self._stop_event.set()
+
+    def run(self):
+        self._logger.info("Alert persister started")
+        self._db_session = Session()
+
+        while not self._stop_event.wait(AlertPersister.FLUSH_PERIOD):
+            self.flush()
+
+        self.flush()
+        self._db_session.close()
+        self._logger.info("Alert persister stopped")
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            references, self._references = self._references, {}
+
+        if not pending and not references:
+            return
+
+        try:
+            for reference in references.values():
+                self._db_session.query(Sensor).filter_by(id=reference.sensor_id).update(
+                    {Sensor.reference_value: reference.new_value}, synchronize_session=False
+                )
+            self._db_session.add_all(references.values())
+
+            for alert in (True, False):
+                sensor_ids = [sensor_id for sensor_id, value in pending.items() if value == alert]
+                if sensor_ids:
+                    self._db_session.query(Sensor).filter(Sensor.id.in_(sensor_ids)).update(
+                        {Sensor.alert: alert}, synchronize_session=False
+                    )
+            self._db_session.commit()
+            if pending:
+                storage.increment(storage.SENSORS_VERSION)
+            self._logger.debug("Saved alert state of sensors: %s, references: %s", pending, list(references))
+        except SQLAlchemyError:
+            self._logger.exception("Failed to save alert state of sensors, retry later")
+            self._db_session.rollback()
+            # the records are reused in the next try
+            self._db_session.expunge_all()
+            with self._lock:
+                # keep the newer changes
+                pending.update(self._pending)
+                self._pending = pending
+                references.update(self._references)
+                self._references = references
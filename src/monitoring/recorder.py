@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# @Description: Recording the raw values of the sensor channels.
+#   The samples are collected in a ring buffer by the monitor and saved periodically
+#   to memory mapped sample files. A new file is started every rotation period.
+#
+#   File format (little endian):
+#     header: magic (4s), version (H), channel count (H), capacity (I), record count (I)
+#     records: timestamp (d), value of the channels (f * channel count)
+import logging
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from glob import glob
+from math import inf
+from threading import Event, Lock, Thread
+from time import time
+
+from monitoring.constants import LOG_RECORDER, THREAD_RECORDER
+
+# directory of the sample files (recording is disabled if not defined)
+SAMPLES_PATH = os.environ.get("SAMPLES_PATH")
+# hours of keeping the sample files
+SAMPLES_RETENTION = float(os.environ.get("SAMPLES_RETENTION", 24))
+# seconds of samples in one file
+ROTATION_PERIOD = 3600
+# number of samples kept in memory
+RING_SIZE = 1024
+# seconds between saving the samples
+SPILL_PERIOD = 1
+
+FILE_MAGIC = b"ARGS"
+FILE_VERSION = 1
+FILE_NAME = "samples-%Y%m%d-%H%M%S.bin"
+HEADER = struct.Struct("<4sHHII")
+
+
+def record_format(channels):
+    return struct.Struct("<d%df" % channels)
+
+
+class SampleFile(object):
+    """Append-only file of fixed size records, the size of the file is allocated at creation"""
+
+    def __init__(self, filename, channels, capacity):
+        self.filename = filename
+        self.channels = channels
+        self.capacity = capacity
+        self.count = 0
+        self.created = time()
+        self._record = record_format(channels)
+        with open(filename, "w+b") as file:
+            file.truncate(HEADER.size + capacity * self._record.size)
+            self._mmap = mmap.mmap(file.fileno(), 0)
+        self._write_header()
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+    def append(self, timestamps, values):
+        """Save the records while there is free space and return the number of saved records"""
+        saved = min(len(timestamps), self.capacity - self.count)
+        offset = HEADER.size + self.count * self._record.size
+        channels = self.channels
+        for index in range(saved):
+            first, last = index * channels, (index + 1) * channels
+            self._record.pack_into(self._mmap, offset, timestamps[index], *values[first:last])
+            offset += self._record.size
+
+        self.count += saved
+        self._write_header()
+        return saved
+
+    def close(self):
+        """Release the unused space of the file"""
+        self._mmap.flush()
+        self._mmap.close()
+        os.truncate(self.filename, HEADER.size + self.count * self._record.size)
+
+    def _write_header(self):
+        HEADER.pack_into(self._mmap, 0, FILE_MAGIC, FILE_VERSION, self.channels, self.capacity, self.count)
+
+
+class SampleRecorder(Thread):
+    """
+    Collects the values of the sensor channels in a ring buffer (record is called in every sampling cycle)
+    and saves them to the sample files in the background.
+    """
+
+    def __init__(self, channels, sample_rate):
+        super(SampleRecorder, self).__init__(name=THREAD_RECORDER, daemon=True)
+        self._logger = logging.getLogger(LOG_RECORDER)
+        self._channels = channels
+        self._sample_rate = sample_rate
+        self._lock = Lock()
+        self._timestamps = array("d", [0.0] * RING_SIZE)
+        self._values = array("d", [0.0] * (RING_SIZE * channels))
+        # number of the recorded and the saved samples
+        self._recorded = 0
+        self._saved = 0
+        self._dropped = 0
+        self._file = None
+        self._stop_event = Event()
+
+    def record(self, values):
+        """Save the values of the channels into the ring buffer"""
+        with self._lock:
+            index = self._recorded % RING_SIZE
+            first, last = index * self._channels, (index + 1) * self._channels
+            self._timestamps[index] = time()
+            self._values[first:last] = values[: self._channels]
+            self._recorded += 1
+
+    def stop(self):
+        """Save the pending samples and stop the thread"""
+        self._stop_event.set()
+
+    def run(self):
+        if not SAMPLES_PATH:
+            self._logger.info("Sample recording disabled")
+            return
+
+        self._logger.info("Sample recorder started")
+        os.makedirs(SAMPLES_PATH, exist_ok=True)
+        while not self._stop_event.wait(SPILL_PERIOD):
+            self.spill()
+
+        self.spill()
+        if self._file:
+            self._file.close()
+        self._logger.info("Sample recorder stopped")
+
+    def spill(self):
+        timestamps, values = self.take_pending()
+        try:
+            while timestamps:
+                if self._file is None or self._file.full or time() - self._file.created >= ROTATION_PERIOD:
+                    self.rotate()
+
+                saved = self._file.append(timestamps, values)
+                first = saved * self._channels
+                timestamps = timestamps[saved:]
+                values = values[first:]
+        except OSError:
+            self._logger.exception("Failed to save samples")
+            self._file = None
+
+    def take_pending(self):
+        """Copy the samples not saved yet from the ring buffer"""
+        with self._lock:
+            pending = self._recorded - self._saved
+            if pending > RING_SIZE:
+                self._dropped += pending - RING_SIZE
+                self._logger.warning("Samples dropped: %s", self._dropped)
+                pending = RING_SIZE
+
+            timestamps = array("d")
+            values = array("d")
+            for sample in range(self._recorded - pending, self._recorded):
+                index = sample % RING_SIZE
+                first, last = index * self._channels, (index + 1) * self._channels
+                timestamps.append(self._timestamps[index])
+                values.extend(self._values[first:last])
+            self._saved = self._recorded
+
+        return timestamps, values
+
+    def rotate(self):
+        if self._file:
+            self._file.close()
+
+        filename = os.path.join(SAMPLES_PATH, datetime.now().strftime(FILE_NAME))
+        self._file = SampleFile(filename, self._channels, int(ROTATION_PERIOD * self._sample_rate))
+        self._logger.debug("Sample file created: %s", filename)
+
+        # remove the old files
+        for old_file in glob(os.path.join(SAMPLES_PATH, "samples-*.bin")):
+            if file_created(old_file) < time() - SAMPLES_RETENTION * 3600:
+                os.remove(old_file)
+                self._logger.debug("Sample file removed: %s", old_file)
+
+
+def file_created(filename):
+    """Return the timestamp of the first record from the name of the file"""
+    return datetime.strptime(os.path.basename(filename), FILE_NAME).timestamp()
+
+
+def read_samples(start, end, path=SAMPLES_PATH):
+    """Return the timestamps and the values of the channels (list of tuples) recorded between start and end"""
+    timestamps = []
+    values = []
+    if not path:
+        return timestamps, values
+
+    filenames = sorted(glob(os.path.join(path, "samples-*.bin")))
+    for filename in filenames:
+        # one file contains samples of one rotation period
+        created = file_created(filename)
+        if created > end or created + ROTATION_PERIOD < start:
+            continue
+
+        with open(filename, "rb") as file:
+            data = file.read()
+
+        if len(data) < HEADER.size:
+            continue
+
+        magic, version, channels, _, count = HEADER.unpack_from(data)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            continue
+
+        record = record_format(channels)
+        count = min(count, (len(data) - HEADER.size) // record.size)
+        file_timestamps = [
+            struct.unpack_from("<d", data, HEADER.size + index * record.size)[0] for index in range(count)
+        ]
+        first = bisect_left(file_timestamps, start)
+        last = bisect_left(file_timestamps, end)
+        for index in range(first, last):
+            sample = record.unpack_from(data, HEADER.size + index * record.size)
+            timestamps.append(sample[0])
+            values.append(sample[1:])
+
+    return timestamps, values
+
+
+def downsample(timestamps, values, start, end, points):
+    """Summarize the samples in equal time buckets with the minimum, average and maximum of the channels"""
+    buckets = []
+    if not timestamps or points < 1 or end <= start:
+        return buckets
+
+    width = (end - start) / points
+    channels = len(values[0])
+    current = None
+    for timestamp, sample in zip(timestamps, values):
+        bucket = min(int((timestamp - start) / width), points - 1)
+        if current is None or current[0] != bucket:
+            if current:
+                buckets.append(summarize(start, width, current))
+            current = [bucket, 0, [inf] * channels, [0.0] * channels, [-inf] * channels]
+
+        current[1] += 1
+        for channel, value in enumerate(sample):
+            current[2][channel] = min(current[2][channel], value)
+            current[3][channel] += value
+            current[4][channel] = max(current[4][channel], value)
+
+    buckets.append(summarize(start, width, current))
+    return buckets
+
+
+def summarize(start, width, bucket):
+    index, count, minimums, sums, maximums = bucket
+    return {
+        "time": datetime.fromtimestamp(start + index * width).isoformat(sep=" ", timespec="milliseconds"),
+        "min": minimums,
+        "avg": [value / count for value in sums],
+        "max": maximums,
+    }
@@ -7,9 +7,11 @@
 import json
 import logging
 import os
-import socketio
-
+from threading import Lock
 
+import eventlet
+import socketio
+from eventlet import wsgi
 from flask import Flask
 from urllib.parse import parse_qs, urlparse
 from jose import jwt
@@ -34,9 +36,19 @@ else:
 if len(allowed_origins) == 1:
     allowed_origins = allowed_origins[0]
 
-sio = socketio.Server(async_mode="threading", cors_allowed_origins=allowed_origins)
+sio = socketio.Server(async_mode="eventlet", cors_allowed_origins=allowed_origins)
 logger = logging.getLogger(LOG_SOCKETIO)
-logging.getLogger("werkzeug").setLevel(logging.DEBUG)
+
+# seconds between emitting the queued messages
+EMIT_PERIOD = 0.1
+# only the last message of these types is emitted in a period
+COALESCED_MESSAGES = ("sensors_state_change", "system_state_change")
+
+# messages waiting for the emitter: [[message_type, message], ...]
+_outbox = []
+# index of the coalesced message types in the outbox
+_coalesced = {}
+_outbox_lock = Lock()
 
 
 def start_socketio():
@@ -45,13 +57,29 @@ def start_socketio():
     app = Flask(__name__)
     # wrap Flask application with socketio's middleware
     app.wsgi_app = socketio.WSGIApp(sio, app.wsgi_app)
-    app.run(
-        threaded=True,
-        host=os.environ["MONITOR_HOST"],
-        port=int(os.environ["MONITOR_PORT"]),
+
+    # the emitter runs in the event loop of the server (the only place sio.emit is called)
+    sio.start_background_task(emit_messages)
+    wsgi.server(
+        eventlet.listen((os.environ["MONITOR_HOST"], int(os.environ["MONITOR_PORT"]))),
+        app,
+        log=logger,
+        log_output=False,
     )
 
 
+def emit_messages():
+    global _outbox, _coalesced
+
+    while True:
+        sio.sleep(EMIT_PERIOD)
+        with _outbox_lock:
+            messages, _outbox, _coalesced = _outbox, [], {}
+
+        for message_type, message in messages:
+            sio.emit(message_type, message)
+
+
 @sio.on("connect")
 def connect(sid, environ):
     logger.debug('Client info "%s": %s', sid, environ)
@@ -110,5 +138,14 @@ def send_power_state_change(power_state):
 
 
 def send_message(message_type, message):
+    """Queue the message for the emitter (never blocks the calling thread on the clients)"""
     logging.getLogger("SocketIO").debug("Sending message: %s -> %s", message_type, message)
-    sio.emit(message_type, message)
+    with _outbox_lock:
+        if message_type in COALESCED_MESSAGES:
+            index = _coalesced.get(message_type)
+            if index is not None:
+                _outbox[index][1] = message
+                return
+            _coalesced[message_type] = len(_outbox)
+
+        _outbox.append([message_type, message])
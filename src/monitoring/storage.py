@@ -3,19 +3,99 @@
 # @Date:   2021-02-25 20:06:58
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:07:17
-# @Description: In memory storage for communicating between threads
-# TODO: make it thread safe???
+# @Description: In memory storage for communicating between threads.
+#   Every change increments the version of the storage and is passed to the subscribers,
+#   the readers can wait for a newer version instead of polling.
+import logging
+from threading import Condition
+
+from monitoring.constants import LOG_SERVICE
 
 _data = dict()
+_counters = dict()
+_version = 0
+_subscribers = []
+_condition = Condition()
 
 ARM_STATE = 0
 MONITORING_STATE = 1
 POWER_STATE = 2
+# counters of the changes saved in the database (for caching the responses of the server),
+# they aren't part of the versioned state (don't wake up the readers waiting for the state)
+CONFIGURATION_VERSION = 3
+SENSORS_VERSION = 4
 
 
 def get(key):
-    return _data.get(key, None)
+    with _condition:
+        return _data.get(key, None)
 
 
 def set(key, value):
+    with _condition:
+        if key in _data and _data[key] == value:
+            return
+
+        version, subscribers = _store(key, value)
+
+    _notify(subscribers, version, key, value)
+
+
+def get_counter(key):
+    with _condition:
+        return _counters.get(key, 0)
+
+
+def increment(key):
+    """Increment the counter stored with the key"""
+    with _condition:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def _store(key, value):
+    """Save the value (holding the lock) and return the new version and the subscribers to notify"""
+    global _version
+
     _data[key] = value
+    _version += 1
+    _condition.notify_all()
+    return _version, list(_subscribers)
+
+
+def _notify(subscribers, version, key, value):
+    # notify outside of the lock
+    for callback in subscribers:
+        try:
+            callback(version, key, value)
+        except Exception:
+            logging.getLogger(LOG_SERVICE).exception("Storage subscriber failed")
+
+
+def get_version():
+    with _condition:
+        return _version
+
+
+def snapshot():
+    """Return the version and a copy of the data"""
+    with _condition:
+        return _version, dict(_data)
+
+
+def wait_for_change(version, timeout=None):
+    """Wait until the version differs from the given one, return the version and a copy of the data"""
+    with _condition:
+        _condition.wait_for(lambda: _version != version, timeout)
+        return _version, dict(_data)
+
+
+def subscribe(callback):
+    """Register a callback(version, key, value) called on every change"""
+    with _condition:
+        _subscribers.append(callback)
+
+
+def unsubscribe(callback):
+    with _condition:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import monotonic
+
+
+class Timer(object):
+    """Callback scheduled on a timer queue"""
+
+    __slots__ = ("deadline", "callback", "args", "cancelled")
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerQueue(object):
+    """
+    Heap of timers executed by the thread owning the queue.
+
+    Cancelling a timer only marks it, the entry is dropped from the heap when it's due
+    (or when the cancelled entries outnumber the active ones).
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._sequence = count()
+        self._cancelled = 0
+
+    def schedule(self, delay, callback, *args):
+        """Call the callback after the delay (seconds)"""
+        timer = Timer(monotonic() + delay, callback, args)
+        heappush(self._heap, (timer.deadline, next(self._sequence), timer))
+        return timer
+
+    def cancel(self, timer):
+        if not timer.cancelled:
+            timer.cancel()
+            self._cancelled += 1
+            if self._cancelled > len(self._heap) // 2:
+                self._compact()
+
+    def cancel_all(self):
+        for _, _, timer in self._heap:
+            timer.cancel()
+        self._heap = []
+        self._cancelled = 0
+
+    def run_pending(self):
+        """Execute the timers which are due"""
+        now = monotonic()
+        while self._heap and self._heap[0][0] <= now:
+            _, _, timer = heappop(self._heap)
+            if timer.cancelled:
+                self._cancelled -= 1
+            else:
+                timer.cancelled = True
+                timer.callback(*timer.args)
+
+    def _compact(self):
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapify(self._heap)
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
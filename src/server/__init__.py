@@ -3,25 +3,45 @@
 # @Date:   2021-02-25 20:05:40
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:05:42
+import json
 import logging
 import os
 import re
 from datetime import datetime as dt
 from os.path import isfile, join
+from threading import BoundedSemaphore
+from time import monotonic
 
 import jose.exceptions
 from dateutil.tz import tzlocal
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, jsonify, request, send_from_directory, stream_with_context
 from flask.helpers import make_response
 from jose import jwt
-
-from models import Alert, Keypad, KeypadType, Option, Sensor, SensorType, User, Zone, hash_code
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload
+
+from models import (
+    Alert,
+    Keypad,
+    KeypadType,
+    Option,
+    Sensor,
+    SensorFilter,
+    SensorReference,
+    SensorType,
+    User,
+    Zone,
+    hash_code,
+)
 from monitoring.constants import ROLE_USER
+from monitoring.recorder import downsample, read_samples
 from server.blueprints.power import power
 from server.database import db
-from server.decorators import authenticated, generate_user_token, registered, restrict_host
+from server.decorators import authenticated, conditional, generate_user_token, registered, restrict_host
 from server.ipc import IPCClient
-from server.tools import process_ipc_response
+from server.options import option_cache
+from server.state import state_feed
+from server.tools import decode_cursor, encode_cursor, process_ipc_response, process_state
 from server.version import __version__
 from tools.clock import Clock
 
@@ -48,6 +68,22 @@ app.config["SQLALCHEMY_DATABASE_URI"] = "postgresql://%(user)s:%(pw)s@%(host)s:%
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.use_reloader = False
 
+# number of alerts returned in one page
+ALERTS_PAGE_SIZE = 50
+ALERTS_MAX_PAGE_SIZE = 500
+# maximum seconds of waiting for a state change in one request
+STATE_MAX_WAIT = 20
+# seconds of one event stream (the client reconnects)
+EVENT_STREAM_DURATION = 300
+# waiting requests (long polling and event streams) in one worker process
+# (less than the threads of the worker to keep threads for the other requests)
+MAX_WAITING_REQUESTS = 4
+waiting_requests = BoundedSemaphore(MAX_WAITING_REQUESTS)
+# default seconds of samples before and after the start of the alert
+SAMPLES_WINDOW = 30
+# maximum number of points of the samples
+SAMPLES_MAX_POINTS = 1000
+
 # avoid reloading records from database after session commit
 db.init_app(app)
 
@@ -134,7 +170,32 @@ def register_device():
 @authenticated(role=ROLE_USER)
 @restrict_host
 def get_alerts():
-    return jsonify([i.serialize for i in db.session.query(Alert).order_by(Alert.start_time.desc())])
+    """
+    Alerts from the latest by pages.
+    Parameters: limit, type (alert type), from/to (start time in ISO format), after (cursor of the next page).
+    The cursor of the next page is returned in the X-Next-Cursor header.
+    """
+    query = db.session.query(Alert).options(joinedload(Alert.sensors))
+    try:
+        limit = max(1, min(int(request.args.get("limit", ALERTS_PAGE_SIZE)), ALERTS_MAX_PAGE_SIZE))
+        if request.args.get("type"):
+            query = query.filter(Alert.alert_type == request.args["type"])
+        if request.args.get("from"):
+            query = query.filter(Alert.start_time >= dt.fromisoformat(request.args["from"]))
+        if request.args.get("to"):
+            query = query.filter(Alert.start_time < dt.fromisoformat(request.args["to"]))
+        if request.args.get("after"):
+            start_time, alert_id = decode_cursor(request.args["after"])
+            query = query.filter(tuple_(Alert.start_time, Alert.id) < tuple_(start_time, alert_id))
+    except ValueError as error:
+        return make_response(jsonify({"error": str(error)}), 400)
+
+    alerts = query.order_by(Alert.start_time.desc(), Alert.id.desc()).limit(limit + 1).all()
+
+    response = jsonify([i.serialize for i in alerts[:limit]])
+    if len(alerts) > limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(alerts[limit - 1].start_time, alerts[limit - 1].id)
+    return response
 
 
 @app.route("/api/alert", methods=["GET"])
@@ -148,6 +209,37 @@ def get_alert():
         return jsonify(None)
 
 
+@app.route("/api/alert/<int:alert_id>/samples", methods=["GET"])
+@authenticated(role=ROLE_USER)
+@restrict_host
+def get_alert_samples(alert_id):
+    """
+    Recorded values of the sensor channels around the start of the alert.
+    Parameters: before/after (seconds from the start time), points (number of the time buckets).
+    """
+    alert = db.session.query(Alert).get(alert_id)
+    if not alert:
+        return make_response(jsonify({"error": "Alert not found"}), 404)
+
+    try:
+        before = max(0.0, float(request.args.get("before", SAMPLES_WINDOW)))
+        after = max(0.0, float(request.args.get("after", SAMPLES_WINDOW)))
+        points = max(1, min(int(request.args.get("points", SAMPLES_MAX_POINTS)), SAMPLES_MAX_POINTS))
+    except ValueError as error:
+        return make_response(jsonify({"error": str(error)}), 400)
+
+    start = alert.start_time.timestamp() - before
+    end = alert.start_time.timestamp() + after
+    timestamps, values = read_samples(start, end)
+    return jsonify(
+        {
+            "alertId": alert.id,
+            "channels": [alert_sensor.channel for alert_sensor in alert.sensors],
+            "samples": downsample(timestamps, values, start, end, points),
+        }
+    )
+
+
 @app.route("/api/users", methods=["GET", "POST"])
 @authenticated()
 @restrict_host
@@ -234,6 +326,7 @@ def registration_code(user_id):
 @app.route("/api/sensors/", methods=["GET"])
 @authenticated(role=ROLE_USER)
 @restrict_host
+@conditional("configuration", "sensors")
 def view_sensors():
     app.logger.debug("Request->alerting: %s", request.args.get("alerting"))
     if not request.args.get("alerting"):
@@ -305,9 +398,27 @@ def sensor(sensor_id):
     return make_response(jsonify({"error": "Unknown action"}), 400)
 
 
+@app.route("/api/sensor/<int:sensor_id>/references", methods=["GET"])
+@authenticated()
+@restrict_host
+def sensor_references(sensor_id):
+    """Audit trail of the reference value of the sensor (from the latest)"""
+    limit = max(1, min(request.args.get("limit", ALERTS_PAGE_SIZE, type=int), ALERTS_MAX_PAGE_SIZE))
+    return jsonify(
+        [
+            i.serialize
+            for i in db.session.query(SensorReference)
+            .filter_by(sensor_id=sensor_id)
+            .order_by(SensorReference.time.desc())
+            .limit(limit)
+        ]
+    )
+
+
 @app.route("/api/sensortypes")
 @authenticated(role=ROLE_USER)
 @restrict_host
+@conditional("configuration")
 def sensor_types():
     return jsonify([i.serialize for i in db.session.query(SensorType).all()])
 
@@ -327,6 +438,7 @@ def get_sensor_alert():
 @app.route("/api/zones/", methods=["GET"])
 @authenticated(role=ROLE_USER)
 @restrict_host
+@conditional("configuration")
 def get_zones():
     return jsonify([i.serialize for i in db.session.query(Zone).filter_by(deleted=False).all()])
 
@@ -377,11 +489,61 @@ def zone(zone_id):
     return make_response(jsonify({"error": "Unknown action"}), 400)
 
 
+@app.route("/api/sensorfilters/", methods=["GET"])
+@authenticated()
+@restrict_host
+def get_sensor_filters():
+    return jsonify([i.serialize for i in db.session.query(SensorFilter).order_by(SensorFilter.id).all()])
+
+
+@app.route("/api/sensorfilters/", methods=["POST"])
+@authenticated()
+@restrict_host
+def create_sensor_filter():
+    sensor_filter = SensorFilter()
+    sensor_filter.update(request.json)
+    db.session.add(sensor_filter)
+    db.session.commit()
+    return process_ipc_response(IPCClient().update_configuration())
+
+
+@app.route("/api/sensorfilter/<int:filter_id>", methods=["GET", "PUT", "DELETE"])
+@authenticated()
+@restrict_host
+def sensor_filter(filter_id):
+    if request.method == "GET":
+        sensor_filter = db.session.query(SensorFilter).get(filter_id)
+        if sensor_filter:
+            return jsonify(sensor_filter.serialize)
+
+        return make_response(jsonify({"error": "Sensor filter not found"}), 404)
+    elif request.method == "DELETE":
+        sensor_filter = db.session.query(SensorFilter).get(filter_id)
+        if sensor_filter:
+            db.session.delete(sensor_filter)
+            db.session.commit()
+            return process_ipc_response(IPCClient().update_configuration())
+
+        return make_response(jsonify({"error": "Sensor filter not found"}), 404)
+    elif request.method == "PUT":
+        sensor_filter = db.session.query(SensorFilter).get(filter_id)
+        if sensor_filter:
+            if sensor_filter.update(request.json):
+                db.session.commit()
+                return process_ipc_response(IPCClient().update_configuration())
+            else:
+                return make_response("", 204)
+
+        return make_response(jsonify({"error": "Sensor filter not found"}), 404)
+
+    return make_response(jsonify({"error": "Unknown action"}), 400)
+
+
 @app.route("/api/monitoring/arm", methods=["GET"])
 @registered
 @restrict_host
 def get_arm():
-    return process_ipc_response(IPCClient().get_arm())
+    return process_state(state_feed.get(), "arm", "type")
 
 
 @app.route("/api/monitoring/arm", methods=["PUT"])
@@ -402,7 +564,60 @@ def disarm():
 @registered
 @restrict_host
 def get_state():
-    return process_ipc_response(IPCClient().get_state())
+    """
+    Return the state of the monitoring.
+    With the version of the last state (long polling) the response is sent when the state changes
+    or the timeout expires. Without free waiting slot the current state is returned immediately.
+    """
+    version = request.args.get("version", type=int)
+    if version is None or not waiting_requests.acquire(blocking=False):
+        return process_state(state_feed.get())
+
+    try:
+        timeout = min(request.args.get("timeout", STATE_MAX_WAIT, type=float), STATE_MAX_WAIT)
+        return process_state(state_feed.wait_for_change(version, max(timeout, 0)))
+    finally:
+        waiting_requests.release()
+
+
+@app.route("/api/monitoring/events", methods=["GET"])
+@registered
+@restrict_host
+def get_state_events():
+    """Server-sent events of the state of the monitoring (the id of the event is the version of the state)"""
+    if not waiting_requests.acquire(blocking=False):
+        # the client falls back to polling the state
+        response = make_response(jsonify({"message": "Too many event streams"}), 503)
+        response.headers["Retry-After"] = str(STATE_MAX_WAIT)
+        return response
+
+    version = request.headers.get("Last-Event-ID", type=int)
+
+    def generate_events():
+        deadline = monotonic() + EVENT_STREAM_DURATION
+        current_version = version
+        yield "retry: 1000\n\n"
+        while monotonic() < deadline:
+            state = state_feed.wait_for_change(current_version, STATE_MAX_WAIT)
+            if state is None:
+                # monitoring service is not available
+                return
+
+            if state["version"] == current_version:
+                # keep the connection alive
+                yield ": keepalive\n\n"
+                continue
+
+            current_version = state["version"]
+            yield f"id: {current_version}\nevent: state\ndata: {json.dumps(state)}\n\n"
+
+    response = Response(stream_with_context(generate_events()), mimetype="text/event-stream")
+    # released even if the stream isn't started
+    response.call_on_close(waiting_requests.release)
+    response.headers["Cache-Control"] = "no-cache"
+    # disable the buffering of nginx
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
 
 
 @app.route("/api/config/<string:option>/<string:section>", methods=["GET", "PUT"])
@@ -425,6 +640,7 @@ def option(option, section):
         # do update
         changed = db_option.update_value(request.json)
         db.session.commit()
+        option_cache.invalidate(option, section)
 
         if option == "notifications":
             if changed:
@@ -441,6 +657,13 @@ def option(option, section):
     return make_response(jsonify({"error": "Unknown action"}), 400)
 
 
+@app.route("/api/job/<int:job_id>", methods=["GET"])
+@authenticated()
+@restrict_host
+def get_job(job_id):
+    return process_ipc_response(IPCClient().get_job(job_id))
+
+
 @app.route("/api/version", methods=["GET"])
 @restrict_host
 def version():
@@ -485,6 +708,7 @@ def set_clock():
 @app.route("/api/keypads/", methods=["GET"])
 @authenticated(role=ROLE_USER)
 @restrict_host
+@conditional("configuration")
 def get_keypads():
     # return jsonify([i.serialize for i in db.session.query(Keypad).filter_by(deleted=False).all()])
     return jsonify([i.serialize for i in db.session.query(Keypad).all()])
@@ -529,6 +753,7 @@ def keypad(keypad_id):
 @app.route("/api/keypadtypes", methods=["GET"])
 @authenticated()
 @restrict_host
+@conditional("configuration")
 def keypadtypes():
     return jsonify([i.serialize for i in db.session.query(KeypadType).all()])
 
@@ -4,9 +4,9 @@
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:06:35
 from flask.blueprints import Blueprint
-from server.tools import process_ipc_response
+from server.tools import process_state
 from server.decorators import registered
-from server.ipc import IPCClient
+from server.state import state_feed
 
 power = Blueprint("power", __name__)
 
@@ -14,4 +14,4 @@ power = Blueprint("power", __name__)
 @power.route("/api/power", methods=["GET"])
 @registered
 def power_state():
-    return process_ipc_response(IPCClient().get_power_state())
+    return process_state(state_feed.get(), "power", "state")
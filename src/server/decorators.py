@@ -4,7 +4,6 @@
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:06:02
 import functools
-import json
 import logging
 import os
 
@@ -12,24 +11,27 @@ from datetime import datetime as dt
 from urllib.parse import urlparse
 from dateutil.tz import UTC
 from flask.globals import request
+from flask.helpers import make_response
 from flask.json import jsonify
 from jose import jwt
 import jose
 
-from models import Option
 from monitoring.constants import ROLE_ADMIN, ROLE_USER, USER_TOKEN_EXPIRY
-from server.database import db
+from server.ipc import IPCClient
+from server.options import option_cache
+from server.tokens import token_cache
 
 
 logger = logging.getLogger("server")
 
+# refresh the user token after this fraction of its lifetime
+USER_TOKEN_REFRESH = float(os.environ.get("USER_TOKEN_REFRESH", 0.5))
+
 
 def restrict_host(request_handler):
     @functools.wraps(request_handler)
     def _restrict_host(*args, **kws):
-        noip_config = db.session.query(Option).filter_by(name="network", section="dyndns").first()
-        if noip_config:
-            noip_config = json.loads(noip_config.value)
+        noip_config = option_cache.get("network", "dyndns")
 
         if noip_config and noip_config.get("restrict_host", False):
             allowed_hostname = noip_config.get("hostname", None)
@@ -54,7 +56,7 @@ def registered(request_handler):
         raw_token = auth_header.split(" ")[1] if auth_header else ""
         if raw_token:
             try:
-                token = jwt.decode(raw_token, os.environ.get("SECRET"), algorithms="HS256")
+                token = token_cache.decode(raw_token)
                 logger.debug("Token: %s", token)
                 return request_handler(*args, **kws)
             except jose.exceptions.JWTError:
@@ -85,9 +87,10 @@ def authenticated(role=ROLE_ADMIN):
             raw_token = auth_header.split(" ")[1] if auth_header else ""
             if raw_token:
                 try:
-                    token = jwt.decode(raw_token, os.environ.get("SECRET"), algorithms="HS256")
-                    logger.info("Token: %s", token)
-                    if int(token["timestamp"]) < int(dt.now(tz=UTC).timestamp()) - USER_TOKEN_EXPIRY:
+                    token = token_cache.decode(raw_token)
+                    logger.debug("Token: %s", token)
+                    token_age = int(dt.now(tz=UTC).timestamp()) - int(token["timestamp"])
+                    if token_age > USER_TOKEN_EXPIRY:
                         return jsonify({"error": "token expired"}), 401
 
                     # HTTP_ORIGIN is not always sent
@@ -112,9 +115,10 @@ def authenticated(role=ROLE_ADMIN):
 
                     response = request_handler(*args, **kws)
                     # generate new user token to extend the user session
-                    response.headers["User-Token"] = generate_user_token(
-                        token["name"], token["role"], f"{origin.scheme}://{origin.netloc}"
-                    )
+                    if token_age >= USER_TOKEN_EXPIRY * USER_TOKEN_REFRESH:
+                        response.headers["User-Token"] = generate_user_token(
+                            token["name"], token["role"], f"{origin.scheme}://{origin.netloc}"
+                        )
                     return response
                 except jose.exceptions.JWTError:
                     logger.warn("Bad token (%s) from %s", raw_token, remote_address)
@@ -126,3 +130,38 @@ def authenticated(role=ROLE_ADMIN):
         return check_access
 
     return _authenticated
+
+
+def conditional(*versions):
+    """
+    Answer the GET request with 304 if the ETag of the client is still valid.
+    The ETag is built from the given versions of the monitoring service ("configuration", "sensors"),
+    which are incremented on every change of the records, so the database is not queried.
+    """
+
+    def _conditional(request_handler):
+        @functools.wraps(request_handler)
+        def check_etag(*args, **kws):
+            # don't cache the filtered responses
+            if request.args:
+                return request_handler(*args, **kws)
+
+            response = IPCClient().get_versions()
+            if not response or not response["result"]:
+                return request_handler(*args, **kws)
+
+            current = response["value"]
+            etag = "-".join([current["boot"]] + [str(current[version]) for version in versions])
+            if etag in request.if_none_match:
+                response = make_response("", 304)
+            else:
+                response = make_response(request_handler(*args, **kws))
+
+            response.set_etag(etag)
+            # always revalidate
+            response.cache_control.no_cache = True
+            return response
+
+        return check_etag
+
+    return _conditional
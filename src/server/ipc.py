@@ -3,9 +3,12 @@
 # @Date:   2021-02-25 20:06:08
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:06:12
-import json
+import logging
+import os
 import socket
+from itertools import count
 from os import environ
+from threading import Event, Lock, Thread
 
 from monitoring.constants import (
     ARM_AWAY,
@@ -21,8 +24,88 @@ from monitoring.constants import (
     MONITOR_UPDATE_KEYPAD,
     MONITOR_GET_STATE,
     MONITOR_GET_ARM,
+    MONITOR_GET_JOB,
+    MONITOR_GET_VERSIONS,
     UPDATE_SSH,
 )
+from tools.ipc import receive_frame, send_frame
+
+# seconds to wait for the response of the monitoring service (long running actions are jobs)
+RESPONSE_TIMEOUT = 30
+
+logger = logging.getLogger("server")
+
+
+class IPCConnection(object):
+    """
+    Persistent connection to the monitoring service shared by the threads of the process.
+
+    The requests are tagged with an id, a reader thread passes the responses to the waiting requests.
+    """
+
+    def __init__(self, address):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(address)
+        self._send_lock = Lock()
+        self._pending_lock = Lock()
+        # request id => [event, response]
+        self._pending = {}
+        self._ids = count(1)
+        self.closed = False
+        Thread(target=self._read_responses, name="IPCReader", daemon=True).start()
+
+    def request(self, message, timeout=RESPONSE_TIMEOUT):
+        request_id = next(self._ids)
+        waiter = [Event(), None]
+        with self._pending_lock:
+            if self.closed:
+                return None
+            self._pending[request_id] = waiter
+
+        try:
+            with self._send_lock:
+                send_frame(self._socket, {**message, "id": request_id})
+        except OSError:
+            logger.exception("Failed to send IPC message")
+            self.close()
+
+        if not waiter[0].wait(timeout):
+            logger.error("No IPC response in %s secs: %s", timeout, message)
+        with self._pending_lock:
+            self._pending.pop(request_id, None)
+
+        return waiter[1]
+
+    def close(self):
+        with self._pending_lock:
+            self.closed = True
+            pending, self._pending = self._pending, {}
+
+        try:
+            self._socket.close()
+        except OSError:
+            pass
+
+        # wake up the waiting requests without response
+        for event, _ in pending.values():
+            event.set()
+
+    def _read_responses(self):
+        try:
+            while True:
+                response = receive_frame(self._socket)
+                if response is None:
+                    break
+
+                with self._pending_lock:
+                    waiter = self._pending.get(response.pop("id", None))
+                if waiter:
+                    waiter[1] = response
+                    waiter[0].set()
+        except (OSError, ValueError):
+            logger.exception("IPC connection failed")
+        finally:
+            self.close()
 
 
 class IPCClient(object):
@@ -30,15 +113,22 @@ class IPCClient(object):
     Sending IPC messages from the REST API to the monitoring service
     """
 
-    _socket = None
+    _connection = None
+    _connection_pid = None
+    _lock = Lock()
+
+    @classmethod
+    def _get_connection(cls):
+        """Connect once per process (workers are forked) and reconnect if the connection closed"""
+        with cls._lock:
+            if cls._connection is None or cls._connection.closed or cls._connection_pid != os.getpid():
+                try:
+                    cls._connection = IPCConnection(environ["MONITOR_INPUT_SOCKET"])
+                    cls._connection_pid = os.getpid()
+                except (ConnectionRefusedError, FileNotFoundError):
+                    cls._connection = None
 
-    def __init__(self):
-        if not self._socket:
-            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            try:
-                self._socket.connect(environ["MONITOR_INPUT_SOCKET"])
-            except ConnectionRefusedError:
-                self._socket = None
+            return cls._connection
 
     def disarm(self):
         return self._send_message({"action": MONITOR_DISARM})
@@ -54,8 +144,13 @@ class IPCClient(object):
         else:
             print("Unknown arm type: %s" % arm_type)
 
-    def get_state(self):
-        return self._send_message({"action": MONITOR_GET_STATE})
+    def get_state(self, version=None, timeout=None):
+        """Get the state of the monitoring (wait up to timeout seconds for a newer version)"""
+        message = {"action": MONITOR_GET_STATE}
+        if version is not None:
+            message["version"] = version
+            message["timeout"] = timeout or 0
+        return self._send_message(message)
 
     def get_power_state(self):
         return self._send_message({"action": POWER_GET_STATE})
@@ -75,13 +170,18 @@ class IPCClient(object):
     def sync_clock(self):
         return self._send_message({"action": MONITOR_SYNC_CLOCK})
 
+    def get_versions(self):
+        return self._send_message({"action": MONITOR_GET_VERSIONS})
+
+    def get_job(self, job_id):
+        return self._send_message({"action": MONITOR_GET_JOB, "job_id": job_id})
+
     def set_clock(self, settings):
         message = {"action": MONITOR_SET_CLOCK}
         message = {**message, **settings}
         return self._send_message(message)
 
     def _send_message(self, message):
-        if self._socket:
-            self._socket.send(json.dumps(message).encode())
-            data = self._socket.recv(1024)
-            return json.loads(data.decode())
+        connection = IPCClient._get_connection()
+        if connection:
+            return connection.request(message)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+import select
+from threading import Lock, Thread
+from time import sleep
+
+from sqlalchemy import text
+
+from models import Option
+from server.database import db
+
+# PostgreSQL notification channel of the changed options
+NOTIFY_CHANNEL = "argus_option_changed"
+# seconds between checking the connection of the listener
+LISTEN_TIMEOUT = 5
+
+logger = logging.getLogger("server")
+
+
+class OptionCache(object):
+    """
+    Process local cache of the (JSON) values of the options.
+
+    The writer invalidates the option after the commit and notifies the other
+    processes (gunicorn workers) through PostgreSQL LISTEN/NOTIFY.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+        # incremented by every invalidation to drop the values loaded meanwhile
+        self._generation = 0
+        self._listener_pid = None
+
+    def get(self, name, section):
+        """Return the value of the option (None if not exists)"""
+        self._start_listener()
+
+        key = (name, section)
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            generation = self._generation
+
+        db_option = db.session.query(Option).filter_by(name=name, section=section).first()
+        value = json.loads(db_option.value) if db_option and db_option.value else None
+
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = value
+
+        return value
+
+    def invalidate(self, name, section):
+        """Drop the option in this process and notify the other processes (call after commit)"""
+        self._drop((name, section))
+        try:
+            db.session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": NOTIFY_CHANNEL, "payload": json.dumps([name, section])},
+            )
+            db.session.commit()
+        except Exception:
+            logger.exception("Failed to notify option change")
+            db.session.rollback()
+
+    def clear(self):
+        self._drop(None)
+
+    def _drop(self, key):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def _start_listener(self):
+        """Start listening to the notifications once in every (forked) process"""
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self._values.clear()
+
+        Thread(target=self._listen, args=(db.engine,), name="OptionListener", daemon=True).start()
+
+    def _listen(self, engine):
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                dbapi_connection = connection.connection
+                dbapi_connection.set_session(autocommit=True)
+                dbapi_connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # notifications might be lost while not listening
+                self.clear()
+
+                while True:
+                    if select.select([dbapi_connection], [], [], LISTEN_TIMEOUT) == ([], [], []):
+                        continue
+
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notification = dbapi_connection.notifies.pop(0)
+                        logger.debug("Option changed: %s", notification.payload)
+                        self._drop(tuple(json.loads(notification.payload)))
+            except Exception:
+                logger.exception("Listening to option changes failed, retry...")
+                self.clear()
+                if connection is not None:
+                    connection.invalidate()
+                sleep(LISTEN_TIMEOUT)
+
+
+option_cache = OptionCache()
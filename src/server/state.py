@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+from threading import Condition, Thread
+from time import sleep
+
+from server.ipc import IPCClient
+
+# seconds to wait for a state change in one IPC request (below the response timeout of the client)
+FEED_TIMEOUT = 20
+# seconds before retrying when the monitoring service is not available
+RETRY_PERIOD = 5
+
+logger = logging.getLogger("server")
+
+
+class StateFeed(object):
+    """
+    Process local copy of the state of the monitoring service.
+
+    One thread per (forked) process long polls the monitoring service and
+    wakes up the requests waiting for a newer version, so the clients don't
+    need an IPC request for every poll.
+    """
+
+    def __init__(self):
+        self._condition = Condition()
+        self._version = None
+        self._state = None
+        # the first response of the monitoring service arrived
+        self._received = False
+        self._feed_pid = None
+
+    def get(self, timeout=FEED_TIMEOUT):
+        """Return the current state (None if the monitoring service is not available)"""
+        self._start_feed()
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._received, timeout)
+            return self._state
+
+    def wait_for_change(self, version, timeout):
+        """Wait until the version of the state differs from the given one, return the state"""
+        self._start_feed()
+
+        with self._condition:
+            self._condition.wait_for(lambda: self._received and self._version != version, timeout)
+            return self._state
+
+    def _update(self, state):
+        with self._condition:
+            self._state = state
+            self._version = state["version"] if state else None
+            self._received = True
+            self._condition.notify_all()
+
+    def _start_feed(self):
+        """Start the feed once in every (forked) process"""
+        if self._feed_pid == os.getpid():
+            return
+
+        with self._condition:
+            if self._feed_pid == os.getpid():
+                return
+            self._feed_pid = os.getpid()
+            self._state = None
+            self._version = None
+            self._received = False
+
+        Thread(target=self._feed, name="StateFeed", daemon=True).start()
+
+    def _feed(self):
+        client = IPCClient()
+        version = None
+        while True:
+            try:
+                response = client.get_state(version, FEED_TIMEOUT)
+            except Exception:
+                logger.exception("Failed to get the monitoring state")
+                response = None
+
+            if response and response["result"]:
+                state = response["value"]
+                version = state["version"]
+                self._update(state)
+            else:
+                logger.debug("Monitoring state not available, retry...")
+                version = None
+                self._update(None)
+                sleep(RETRY_PERIOD)
+
+
+state_feed = StateFeed()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time
+
+from jose import jwt
+
+from monitoring.constants import USER_TOKEN_EXPIRY
+
+
+class VerifiedTokenCache(object):
+    """
+    Bounded LRU cache of the verified tokens by the digest of the raw token.
+
+    A token is verified again after USER_TOKEN_EXPIRY seconds from its timestamp
+    (from the first verification if the token has no timestamp).
+    """
+
+    def __init__(self, size=256):
+        self._size = size
+        self._lock = Lock()
+        # digest => (expiry, claims)
+        self._tokens = OrderedDict()
+
+    def decode(self, raw_token):
+        """Return the claims of the token (raises JWTError if the token is invalid), don't modify the result!"""
+        digest = hashlib.sha256(raw_token.encode()).digest()
+        now = time()
+        with self._lock:
+            entry = self._tokens.get(digest)
+            if entry and entry[0] > now:
+                self._tokens.move_to_end(digest)
+                return entry[1]
+
+        claims = jwt.decode(raw_token, os.environ.get("SECRET"), algorithms="HS256")
+        expiry = int(claims.get("timestamp", now)) + USER_TOKEN_EXPIRY
+
+        with self._lock:
+            self._tokens[digest] = (expiry, claims)
+            self._tokens.move_to_end(digest)
+            while len(self._tokens) > self._size:
+                self._tokens.popitem(last=False)
+
+        return claims
+
+
+token_cache = VerifiedTokenCache()
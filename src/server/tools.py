@@ -3,6 +3,10 @@
 # @Date:   2021-02-25 20:06:16
 # @Last Modified by:   Gábor Kovács
 # @Last Modified time: 2021-02-25 20:06:18
+import base64
+import json
+from datetime import datetime
+
 from flask.helpers import make_response
 from flask.json import jsonify
 
@@ -15,3 +19,25 @@ def process_ipc_response(response):
             return make_response(jsonify({"message": response["message"]}), 500)
     else:
         return make_response(jsonify({"message": "No response from monitoring service"}), 503)
+
+
+def process_state(state, key=None, name=None):
+    """Return the (item of the) state of the monitoring service"""
+    if state is None:
+        return make_response(jsonify({"message": "No response from monitoring service"}), 503)
+
+    return jsonify({name: state[key]} if key else state)
+
+
+def encode_cursor(start_time, record_id):
+    """Create the (opaque) cursor of the next page from the keys of the last record"""
+    return base64.urlsafe_b64encode(json.dumps([start_time.isoformat(), record_id]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return the keys of the cursor (raises ValueError if invalid)"""
+    try:
+        start_time, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(start_time), int(record_id)
+    except (TypeError, ValueError, json.JSONDecodeError) as error:
+        raise ValueError(f"Invalid cursor ({error})")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# @Description: Compare the serialization of the models with the precompiled serializers
+#   and with the former serialize_attributes + convert2camel path.
+import argparse
+import json
+import logging
+from copy import deepcopy
+from datetime import datetime, timedelta
+from logging import basicConfig
+from timeit import timeit
+
+from dateutil.tz import tzlocal
+
+from models import Alert, AlertSensor, Keypad, KeypadType, Option, Sensor, User, Zone, convert2camel, format_time
+from tools.dictionary import filter_keys
+
+parser = argparse.ArgumentParser(description="Compare the serialization of the models.")
+parser.add_argument("--records", type=int, default=64, help="Number of records in one response")
+parser.add_argument("--repeat", type=int, default=1000, help="Number of serialized responses")
+
+args = parser.parse_args()
+
+basicConfig(level=logging.INFO, format="%(message)s")
+
+
+def serialize_alert(alert):
+    return convert2camel(
+        {
+            "id": alert.id,
+            "alert_type": alert.alert_type,
+            "start_time": format_time(alert.start_time),
+            "end_time": format_time(alert.end_time),
+            "sensors": [serialize_alert_sensor(alert_sensor) for alert_sensor in alert.sensors],
+        }
+    )
+
+
+def serialize_alert_sensor(alert_sensor):
+    return convert2camel(alert_sensor.serialize_attributes(("sensor_id", "channel", "type_id", "description")))
+
+
+def serialize_user(user):
+    return convert2camel(
+        {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "has_registration_code": bool(user.registration_code),
+            "registration_expiry": user.registration_expiry.strftime("%Y-%m-%dT%H:%M:%S")
+            if user.registration_expiry
+            else None,
+            "role": user.role,
+            "comment": user.comment,
+        }
+    )
+
+
+def serialize_option(option):
+    filtered_value = deepcopy(json.loads(option.value))
+    filter_keys(filtered_value, ["smtp_password"])
+    filter_keys(filtered_value, ["password"])
+    return convert2camel({"name": option.name, "section": option.section, "value": filtered_value})
+
+
+# model => (records, former serialization of one record)
+MODELS = {
+    Sensor: (
+        lambda index: Sensor(channel=index, sensor_type=None, zone=None, description="Sensor %d" % index),
+        lambda sensor: convert2camel(
+            sensor.serialize_attributes(("id", "channel", "alert", "description", "zone_id", "type_id", "enabled"))
+        ),
+    ),
+    Zone: (
+        lambda index: Zone(name="Zone %d" % index, away_delay=10, description="Zone"),
+        lambda zone: convert2camel(
+            zone.serialize_attributes(("id", "name", "description", "disarmed_delay", "away_delay", "stay_delay"))
+        ),
+    ),
+    Alert: (
+        lambda index: Alert(
+            "away",
+            start_time=datetime.now(tzlocal()),
+            end_time=datetime.now(tzlocal()) + timedelta(minutes=10),
+            sensors=[AlertSensor(channel=channel, type_id=1, description="Sensor") for channel in range(3)],
+        ),
+        serialize_alert,
+    ),
+    AlertSensor: (
+        lambda index: AlertSensor(channel=index, type_id=1, description="Sensor %d" % index),
+        serialize_alert_sensor,
+    ),
+    User: (
+        lambda index: User(name="User %d" % index, role="user", access_code="1234"),
+        serialize_user,
+    ),
+    Option: (
+        lambda index: Option(
+            "notifications", "email", json.dumps({"smtp_username": "user %d" % index, "smtp_password": "secret"})
+        ),
+        serialize_option,
+    ),
+    Keypad: (
+        lambda index: Keypad(keypad_type=None),
+        lambda keypad: convert2camel(keypad.serialize_attributes(("id", "type_id", "enabled"))),
+    ),
+    KeypadType: (
+        lambda index: KeypadType(index, "Keypad %d" % index, "Keypad type"),
+        lambda keypad_type: convert2camel(keypad_type.serialize_attributes(("id", "name", "description"))),
+    ),
+}
+
+for model, (create, serialize_former) in MODELS.items():
+    records = []
+    for index in range(args.records):
+        record = create(index)
+        # the other models have id from the constructor or without id column
+        if model not in (User, AlertSensor, KeypadType):
+            record.id = index
+        records.append(record)
+
+    def serialize_attributes():
+        return [serialize_former(record) for record in records]
+
+    def serialize():
+        return [record.serialize for record in records]
+
+    assert serialize_attributes() == serialize(), f"Serializers of {model.__name__} return different results"
+
+    logging.info(model.__name__)
+    for name, function in (("serialize_attributes + convert2camel", serialize_attributes), ("serializer", serialize)):
+        elapsed = timeit(function, number=args.repeat)
+        logging.info("  %-40s %8.3f ms / response", name, elapsed * 1000 / args.repeat)
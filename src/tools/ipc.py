@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# @Description: Framing of the IPC messages between the server and the monitoring service.
+#   Every message is a JSON object prefixed with its length (4 bytes, network byte order).
+#   Requests and responses are paired by the "id" field, so more requests can be in flight on one connection.
+import json
+import struct
+
+HEADER = struct.Struct("!I")
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
+def send_frame(connection, message):
+    data = json.dumps(message).encode()
+    connection.sendall(HEADER.pack(len(data)) + data)
+
+
+def receive_frame(connection):
+    """Read the next message from the connection (None if the connection closed)"""
+    header = _receive_exactly(connection, HEADER.size)
+    if header is None:
+        return None
+
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError(f"IPC message too large ({length} bytes)")
+
+    data = _receive_exactly(connection, length)
+    if data is None:
+        return None
+
+    return json.loads(data.decode())
+
+
+def _receive_exactly(connection, size):
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = connection.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer.extend(chunk)
+
+    return bytes(buffer)